@@ -15,6 +15,7 @@ from tkinter import filedialog as fd
 from tkinter import messagebox as mb
 from os import path
 from modules.track_it_sheet import TrackItSheet
+from modules.ptw_dedup import PTWSentIndex
 
 # COLOURS 
 PRIMARY = "#0D3B66"
@@ -153,8 +154,17 @@ class TrackItFrame(ttk.Frame):
                          # "When progress bar completes")
                          # )
         if self.ts._status:
+            sent = PTWSentIndex()
+            content_hash = self.ts.ptw_xml.content_hash()
+            if content_hash in sent and not mb.askyesno(
+                title = "Already sent",
+                message = "These results have already been sent to PTW TRACK-IT.\n"
+                          "Send them again?",
+                ):
+                return
             self.ts.ptw_xml.print_xml()
-            self.ts.ptw_xml.export_xml() 
+            if self.ts.ptw_xml.export_xml() == 0:
+                sent.add(content_hash)
             self.ts.ptw_xml.build_xml_log()
             self.text_label.delete("1.0","end") 
             self.text_label.insert(
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+The PTWTrackItBatchXML class merges many PTWTrackItXML records into a single
+<PTW> document, so that one TrackitExporter.exe call carries many measurements.
+
+Shared definitions are written once per document:
+    DataTypes           - deduplicated on id (TRACK-IT name)
+    RadiationUnits      - one id per distinct machineID
+    MeasuringDevices    - deduplicated on device name
+    MeasuringSoftwares  - one id per distinct information["source"]
+
+Each Measurement keeps the guid it would have had in a single record export,
+so re-exports are still recognised by TRACK-IT. Clashing guids within a document
+are made unique with a numeric suffix.
+
+Records are split into documents of at most max_batch_size records.
+
+Records are checked by PTWTrackItValidator as they are added. Invalid records
+are kept out of the documents and listed in rejected, with their issues.
+
+Example usage:
+
+    batch = PTWTrackItBatchXML(max_batch_size = 50)
+    for mpc in mpc_records:
+        batch.add(mpc.build_ptw_xml())
+    batch.print_xml()
+    results = batch.export_xml(user_name = USERNAME, password = PASSWORD)
+
+"""
+
+import os
+from datetime import datetime
+from modules.ptw_xml import PTWTrackItXML
+from modules.xml_writer import XMLStreamWriter
+from modules.ptw_logging import get_logger
+from modules.ptw_export import PTWExportPool
+from modules.ptw_validate import PTWTrackItValidator
+from modules.ptw_template import PTWTrackItTemplate
+from logging import INFO, ERROR
+
+_logger = get_logger("ptw_batch")
+
+
+class PTWTrackItBatchXML():
+    def __init__(self,
+                 records = None,
+                 max_batch_size = 50,
+                 f_prefix = "batch",
+                 import_client_path = None,
+                 record_log = False,
+                 validate = True,
+                 *args, **kwargs):
+        self.records = []
+        self.rejected = [] # (record, issues) pairs kept out of the batch
+        self.validate = validate
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.import_client_path = import_client_path
+        self.f_root = os.getcwd()
+        self._fname = "_".join([
+            f_prefix.replace(" ","_"),
+            datetime.now().strftime('%Y_%m_%d_%H_%M_%S'),
+            ])
+        self._f_out = []
+        self._f_records = []
+        self.record_log = record_log
+        self._xml_build_log = []
+        for record in records or ():
+            self.add(record)
+
+    def add(self, ptw_xml: PTWTrackItXML):
+        '''
+            Add a PTWTrackItXML record to the batch.
+            Returns False, and adds it to rejected instead, if it fails validation.
+        '''
+        if self.validate:
+            issues = PTWTrackItValidator.validate(ptw_xml)
+            if issues:
+                self.rejected.append((ptw_xml, issues))
+                self._log(ERROR, "%s rejected: %s", ptw_xml._fname,
+                          "; ".join(str(issue) for issue in issues))
+                return False
+        self.records.append(ptw_xml)
+        return True
+
+    def batches(self):
+        '''
+            Split the records into lists of at most max_batch_size.
+        '''
+        return [
+            self.records[i:i + self.max_batch_size]
+            for i in range(0, len(self.records), self.max_batch_size)
+        ]
+
+    def stream_xml(self, stream, records, compact = False):
+        '''
+            Write a single <PTW> document for records straight to an open stream.
+        '''
+        doc, tag, text, line = XMLStreamWriter(stream, compact = compact).ttl()
+        first = records[0]
+
+        radiation_units = PTWTrackItBatchXML.index_of(
+            [record.machineID for record in records])
+        softwares = PTWTrackItBatchXML.index_of(
+            [record.information["source"] for record in records])
+        devices = [sorted(record.measuring_devices()) for record in records]
+
+        doc.asis(first._line0)
+        with tag(first._ptw):
+            line('Version', first._version)
+            line('Author', first._author)
+
+            with tag('Content'):
+                with tag('DataTypes'):
+                    seen = set()
+                    for record in records:
+                        record._xml_data_types(tag, line, seen = seen)
+
+                with tag('RadiationUnits'):
+                    for name, ref in radiation_units.items():
+                        with tag('RadiationUnit', id = ref):
+                            line('Name', name)
+
+                with tag('MeasuringDevices'):
+                    for measuring_device in sorted(set().union(*devices)):
+                        with tag('MeasuringDevice', id = measuring_device):
+                            line('Name', measuring_device)
+
+                with tag('MeasuringSoftwares'):
+                    for name, ref in softwares.items():
+                        with tag('MeasuringSoftware', id = ref):
+                            line('Name', name)
+
+                with tag('Measurements'):
+                    guids = set()
+                    for record, record_devices in zip(records, devices):
+                        for measuring_device in record_devices:
+                            guid = PTWTrackItBatchXML.unique_guid(
+                                "_".join([record._fname, measuring_device]), guids)
+                            # same schema, same Measurement: fill a compiled template
+                            doc.asis(PTWTrackItTemplate.for_measurement(
+                                record, measuring_device, compact = compact).render(
+                                    record,
+                                    guid = guid,
+                                    radiation_unit_ref = radiation_units[record.machineID],
+                                    measuring_software_ref = softwares[record.information["source"]],
+                                ))
+
+    def print_xml(self, f_path = None, compact = False, start = 1):
+        '''
+            Write one xml file per batch, numbered from start.
+            Returns the list of file paths written, _f_records holds the 
+            matching list of records for each file.
+        '''
+        if f_path is None:
+            f_path = os.path.join(self.f_root, "xml")
+        self._f_out = []
+        self._f_records = []
+        for n, records in enumerate(self.batches(), start = start):
+            f_out = os.path.normpath(
+                os.path.join(f_path, f"{self._fname}_{n:03d}.xml"))
+            try:
+                with open(f_out, "w") as o:
+                    self.stream_xml(o, records, compact = compact)
+                self._f_out.append(f_out)
+                self._f_records.append(records)
+                self._log(INFO, "xml file generated: %s (%d records)", f_out, len(records))
+            except IOError as e:
+                self._log(ERROR, "Could not generate xml: %s", e)
+        return self._f_out
+
+    def export_xml(self, user_name = None, password = None, pool = None):
+        '''
+            Export each batch file to TRACK-IT using the PTW Export tool.
+            Credentials are passed with -m 1 -u -p when given.
+            Files are sent concurrently by pool, a PTWExportPool (default settings
+            if not given). Returns a list of ExportResult, one per file.
+        '''
+        if not self._f_out:
+            self.print_xml()
+        first = self.records[0] if self.records else None
+        import_client_path = self.import_client_path or (
+            first.import_client_path if first else None)
+        track_it_ip = first._track_it_ip if first else None
+
+        pool = pool or PTWExportPool()
+        jobs = [
+            PTWExportPool.command(import_client_path, f_out, track_it_ip, user_name, password)
+            for f_out in self._f_out
+        ]
+        self._log(INFO, "Sending %d files to TRACK-IT via HTTPS", len(jobs))
+        results = pool.export(jobs)
+        for result in results:
+            self._log(INFO if result.ok else ERROR,
+                      "%s: TRACK-IT Export Process return code: %s (%d attempts) %s",
+                      result.f_path, result.returncode, result.attempts, result.error)
+        return results
+
+    def build_xml_log(self):
+        '''
+            Print the batch log to a single .log file.
+            Only when the log is enabled with record_log = True.
+        '''
+        if not self.record_log:
+            return
+        f_path = os.path.normpath(os.path.join(
+            self.f_root,
+            "log",
+            self._fname+".log"
+            )
+        )
+        with open(f_path, 'w') as w:
+            w.writelines([line+"\n" for line in self._xml_build_log])
+
+    def _log(self, level, msg, *args):
+        '''
+            Lazy, leveled log, as PTWTrackItXML._log.
+        '''
+        if self.record_log:
+            self._xml_build_log.append(msg % args if args else str(msg))
+        if _logger.isEnabledFor(level):
+            _logger.log(level, "%s: " + str(msg), self._fname, *args)
+
+    # -- static methods -- not dependent on object state
+    @staticmethod
+    def index_of(names):
+        '''
+            Assign ids "1", "2", ... to names in order of first appearance.
+        '''
+        index = {}
+        for name in names:
+            if name not in index:
+                index[name] = str(len(index) + 1)
+        return index
+
+    @staticmethod
+    def unique_guid(guid, used):
+        '''
+            Suffix guid with _2, _3, ... until it has not been used in this document.
+        '''
+        candidate, n = guid, 1
+        while candidate in used:
+            n += 1
+            candidate = f"{guid}_{n}"
+        used.add(candidate)
+        return candidate
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+The PTWSentIndex class is a local, persistent record of the measurements already
+delivered to TRACK-IT, so that reruns and overlapping backfills skip them before
+any xml is generated or the export tool is started.
+
+Each record is identified by PTWTrackItXML.content_hash: a SHA-256 digest of the
+RadiationUnit, measurement date, Parameters and AnalysisValues. Identical data
+always gives the same hash, whichever file or spreadsheet it came from.
+
+The index is a plain text file with one hash per line, appended to as records
+are delivered. It is read once into a set on initialisation.
+
+Example usage:
+
+    sent = PTWSentIndex()
+    if ptw_xml.content_hash() not in sent:
+        ...  # export
+        sent.add(ptw_xml.content_hash())
+
+"""
+
+import os
+from threading import Lock
+
+
+class PTWSentIndex():
+    def __init__(self, f_path = None):
+        '''
+            Params:
+                f_path (optional)
+                    Path to the index file, default ./log/sent_index.txt
+                    Created on first add.
+        '''
+        if f_path is None:
+            f_path = os.path.join(os.getcwd(), "log", "sent_index.txt")
+        self.f_path = os.path.normpath(f_path)
+        self._lock = Lock()
+        self._hashes = set()
+        try:
+            with open(self.f_path, "r", encoding = "ascii") as f:
+                self._hashes = {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, content_hash):
+        return content_hash in self._hashes
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, *content_hashes):
+        '''
+            Record hashes as delivered and append them to the index file.
+        '''
+        with self._lock:
+            new = [h for h in dict.fromkeys(content_hashes) if h not in self._hashes]
+            if not new:
+                return
+            os.makedirs(os.path.dirname(self.f_path) or ".", exist_ok = True)
+            with open(self.f_path, "a", encoding = "ascii") as f:
+                f.writelines(h + "\n" for h in new)
+            self._hashes.update(new)
+
+    def filter_new(self, records):
+        '''
+            The PTWTrackItXML records that have not been delivered yet.
+            Repeats of the same content within records are also dropped.
+        '''
+        new, seen = [], set()
+        for record in records:
+            content_hash = record.content_hash()
+            if content_hash not in self._hashes and content_hash not in seen:
+                seen.add(content_hash)
+                new.append(record)
+        return new
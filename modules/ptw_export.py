@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+The PTWExportPool class runs TrackitExporter.exe for many xml files at once.
+
+    bounded concurrency - at most max_workers exporter processes at a time
+    per-job timeout     - a hung upload is killed after timeout seconds
+    retries             - failed or timed out jobs are retried with exponential
+                          backoff, up to retries extra attempts
+    throttling          - the number of concurrent jobs is lowered while the
+                          average exporter latency is above latency_threshold,
+                          and raised again once it recovers
+
+Nothing is raised for a failed export. export returns one ExportResult per file,
+in the order given, and the caller decides what to do with the failures.
+
+Example usage:
+
+    pool = PTWExportPool(max_workers = 4, timeout = 120, retries = 2)
+    jobs = [
+        PTWExportPool.command(client, f, track_it_ip, USERNAME, PASSWORD)
+        for f in xml_files
+    ]
+    results = pool.export(jobs)
+    failed = [r.f_path for r in results if not r.ok]
+
+"""
+
+import random
+import time
+from subprocess import run, TimeoutExpired
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+from contextlib import contextmanager
+from logging import INFO, WARNING, ERROR
+from modules.ptw_logging import get_logger
+
+_logger = get_logger("ptw_export")
+
+
+class ExportResult():
+    '''
+        Outcome of one exporter job.
+
+        Attributes:
+            f_path      - xml file sent
+            returncode  - exporter return code of the last attempt, None if it
+                          timed out or could not be started
+            attempts    - number of times the exporter was run
+            elapsed     - seconds taken by the last attempt
+            error       - description of the last failure, "" on success
+    '''
+    __slots__ = ("f_path", "returncode", "attempts", "elapsed", "error")
+
+    def __init__(self, f_path, returncode = None, attempts = 0, elapsed = 0.0, error = ""):
+        self.f_path = f_path
+        self.returncode = returncode
+        self.attempts = attempts
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def __repr__(self):
+        return (f"ExportResult({self.f_path!r}, returncode={self.returncode!r}, "
+                f"attempts={self.attempts})")
+
+
+class PTWExportPool():
+    def __init__(self,
+                 max_workers = 4,
+                 timeout = 120,
+                 retries = 2,
+                 backoff = 2.0,
+                 max_backoff = 60.0,
+                 latency_threshold = 30.0,
+                 capture_output = True,
+                 ):
+        '''
+            Params:
+                max_workers
+                    Upper limit of concurrent exporter processes.
+                timeout
+                    Seconds before a single exporter run is killed.
+                retries
+                    Extra attempts after a failure or timeout.
+                backoff, max_backoff
+                    Wait backoff * 2**n seconds (capped) before retry n + 1.
+                latency_threshold
+                    Average exporter run time, in seconds, above which
+                    concurrency is reduced.
+                capture_output
+                    Keep the exporter output for ExportResult.error. False
+                    leaves it on the console, e.g. for an interactive export.
+        '''
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.latency_threshold = latency_threshold
+        self.capture_output = capture_output
+
+        self._limit = self.max_workers # current concurrency, adjusted by _record_latency
+        self._active = 0
+        self._latency = None # exponentially weighted average run time
+        self._cond = Condition()
+
+    def export(self, jobs):
+        '''
+            Run every job, a list of (f_path, cmd) pairs as given by command.
+            Returns a list of ExportResult, one per job, in the same order.
+        '''
+        jobs = list(jobs)
+        if not jobs:
+            return []
+        with ThreadPoolExecutor(max_workers = min(self.max_workers, len(jobs))) as ex:
+            return list(ex.map(lambda job: self.export_one(*job), jobs))
+
+    def export_one(self, f_path, cmd):
+        '''
+            Run the exporter for one file, retrying with backoff.
+            Never raises, the outcome is in the returned ExportResult.
+        '''
+        result = ExportResult(f_path)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.delay(attempt))
+            with self._slot():
+                result.attempts += 1
+                start = time.monotonic()
+                try:
+                    pd = run(cmd, capture_output = self.capture_output, text = True,
+                             timeout = self.timeout)
+                    result.returncode = pd.returncode
+                    result.error = "" if pd.returncode == 0 else (
+                        (pd.stderr or pd.stdout or "").strip()[-500:]
+                        or f"return code {pd.returncode}")
+                except TimeoutExpired:
+                    result.returncode = None
+                    result.error = f"timed out after {self.timeout} s"
+                except OSError as e:
+                    result.returncode = None
+                    result.error = str(e)
+                result.elapsed = time.monotonic() - start
+            self._record_latency(result.elapsed)
+
+            if result.ok:
+                _logger.log(INFO, "%s: exported in %.1f s (attempt %d)",
+                            f_path, result.elapsed, result.attempts)
+                break
+            _logger.log(WARNING if attempt < self.retries else ERROR,
+                        "%s: export failed (attempt %d of %d): %s",
+                        f_path, result.attempts, self.retries + 1, result.error)
+        return result
+
+    def delay(self, attempt):
+        '''
+            Seconds to wait before retry number attempt, with a little jitter
+            so that parallel retries do not arrive together.
+        '''
+        wait = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return wait * random.uniform(0.9, 1.1)
+
+    # -- concurrency control --
+    @contextmanager
+    def _slot(self):
+        '''
+            Hold one of the current _limit exporter slots.
+        '''
+        with self._cond:
+            self._cond.wait_for(lambda: self._active < self._limit)
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def _record_latency(self, elapsed):
+        '''
+            Update the average latency and step the concurrency limit:
+            down by one while above the threshold, back up by one once
+            below half of it.
+        '''
+        with self._cond:
+            self._latency = elapsed if self._latency is None else (
+                0.7 * self._latency + 0.3 * elapsed)
+            if self._latency > self.latency_threshold and self._limit > 1:
+                self._limit -= 1
+                _logger.log(WARNING, "exporter latency %.1f s, concurrency lowered to %d",
+                            self._latency, self._limit)
+            elif self._latency < self.latency_threshold / 2 and self._limit < self.max_workers:
+                self._limit += 1
+                self._cond.notify_all()
+
+    # -- static methods -- not dependent on object state
+    @staticmethod
+    def command(import_client_path, f_out, track_it_ip, user_name = None, password = None):
+        '''
+            (f_path, cmd) job for export.
+            import_client_path may be a path, or a list used as the command
+            prefix, e.g. [sys.executable, "tools/fake_exporter.py"].
+            Credentials are passed with -m 1 -u -p when user_name is given.
+        '''
+        if isinstance(import_client_path, (list, tuple)):
+            cmd = list(import_client_path)
+        else:
+            cmd = [import_client_path]
+        cmd += ["-i", f_out, "-o", track_it_ip]
+        if user_name is not None:
+            cmd += ["-m", "1", "-u", user_name, "-p", password or ""]
+        return f_out, cmd
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Build and export logging for the PTW tools, on top of the standard logging module.
+
+All loggers live under the "ptw_tools" namespace. Messages are passed with
+%-style arguments, so nothing is formatted unless a handler will emit the
+message - a disabled level costs a single isEnabledFor check.
+
+Two sinks are available:
+    run log     - configure_run_log attaches one rotating file shared by every
+                  record in a run, e.g. a nightly MPC service run
+    record log  - the original one .log file per record, opt-in via
+                  PTWTrackItXML(record_log = True) and build_xml_log
+
+Example usage:
+
+    configure_run_log("./log/mpc_service.log", level = logging.INFO)
+
+"""
+
+import logging
+import os
+from logging.handlers import RotatingFileHandler
+
+ROOT_LOGGER = "ptw_tools"
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+
+def get_logger(name):
+    '''
+        Logger for a module, within the ptw_tools namespace.
+    '''
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def configure_run_log(f_path = None, level = logging.INFO,
+                      max_bytes = 5 * 1024 * 1024, backup_count = 5):
+    '''
+        Send every ptw_tools log message at or above level to a single
+        rotating log file. Calling again replaces the previous run log.
+
+        Params:
+            f_path
+                Path to the log file, default ./log/ptw_tools.log
+            level
+                logging level, e.g. logging.DEBUG for per-row build messages
+            max_bytes, backup_count
+                Rotation settings passed to RotatingFileHandler
+    '''
+    if f_path is None:
+        f_path = os.path.join(os.getcwd(), "log", "ptw_tools.log")
+    f_path = os.path.normpath(f_path)
+    os.makedirs(os.path.dirname(f_path) or ".", exist_ok = True)
+
+    root = logging.getLogger(ROOT_LOGGER)
+    for handler in [h for h in root.handlers if getattr(h, "_ptw_run_log", False)]:
+        root.removeHandler(handler)
+        handler.close()
+
+    handler = RotatingFileHandler(
+        f_path, maxBytes = max_bytes, backupCount = backup_count, encoding = "utf-8")
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler._ptw_run_log = True
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
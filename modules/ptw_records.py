@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Compact record types for the TRACK-IT Parameters, DataTypes and Measurements tables.
+
+    TrackItRow   - one row, stored in __slots__ rather than a dict
+    TrackItTable - list of TrackItRow, type checked and coerced once at
+                   construction and pre-grouped by MeasuringDevice
+
+Rows still accept the dict style keys used throughout this project
+("track-it", "values", "unit", "valuetype", ...), so existing list of dicts
+tables and code can be used unchanged. The xml generation loop uses the
+attributes directly.
+
+Coercion applied once, at construction:
+    valuetype   lowercased copy kept as vtype
+    comment     defaults to "" (legacy spreadsheets have no comment column)
+    Long        DataType and Measurement values converted with int()
+    Double      Measurement values converted with float(), they are packed as doubles
+
+Parameter values are written as text and are left as given.
+
+Values that cannot be coerced are left unchanged for the validator to report.
+
+Example usage:
+
+    dtypes = TrackItTable(
+        [{"track-it":"*Output", "values":1.003, "unit":"cGy/MU",
+          "valuetype":"Double", "definition": "QA", "measuringdevice": "F18"}],
+        kind = "dtypes",
+    )
+    dtypes.by_device["F18"][0].values
+
+"""
+
+
+class TrackItRow():
+    __slots__ = ("name", "values", "unit", "valuetype", "vtype", "definition",
+                 "comment", "measuringdevice", "positions", "positionunit", "index")
+
+    # dict style key --> attribute
+    KEYS = {
+        "track-it": "name",
+        "values": "values",
+        "unit": "unit",
+        "valuetype": "valuetype",
+        "definition": "definition",
+        "comment": "comment",
+        "measuringdevice": "measuringdevice",
+        "positions": "positions",
+        "positionunit": "positionunit",
+    }
+
+    def __init__(self, name, values, valuetype, unit = None, definition = None,
+                 comment = "", measuringdevice = None, positions = None,
+                 positionunit = None, index = None):
+        self.name = name
+        self.values = values
+        self.unit = unit
+        self.valuetype = valuetype
+        self.vtype = valuetype.lower() if isinstance(valuetype, str) else ""
+        self.definition = definition
+        self.comment = comment if comment is not None else ""
+        self.measuringdevice = measuringdevice
+        self.positions = positions
+        self.positionunit = positionunit
+        self.index = index
+
+    @classmethod
+    def from_dict(cls, row, index = None):
+        '''
+            Build a row from a dict keyed as in the README. Unknown keys are ignored.
+        '''
+        return cls(
+            name = row.get("track-it"),
+            values = row.get("values", ""),
+            valuetype = row.get("valuetype"),
+            unit = row.get("unit"),
+            definition = row.get("definition"),
+            comment = row.get("comment", ""),
+            measuringdevice = row.get("measuringdevice"),
+            positions = row.get("positions"),
+            positionunit = row.get("positionunit"),
+            index = index,
+        )
+
+    @classmethod
+    def from_values(cls, keys, values, index = None):
+        '''
+            Build a row straight from a table row and its column headings, 
+            without an intermediate dict. Unknown headings are ignored.
+        '''
+        row = cls(name = None, values = "", valuetype = None, index = index)
+        for key, value in zip(keys, values):
+            if key in TrackItRow.KEYS:
+                row[key] = value
+        return row
+
+    def copy(self, **kwargs):
+        '''
+            Shallow copy, with any attribute overridden by keyword.
+        '''
+        row = TrackItRow.__new__(TrackItRow)
+        for attr in TrackItRow.__slots__:
+            setattr(row, attr, kwargs.get(attr, getattr(self, attr)))
+        return row
+
+    @property
+    def blank(self):
+        '''
+            Blank cells arrive as empty strings.
+        '''
+        return isinstance(self.values, str) and self.values == ''
+
+    # -- dict style access -- backward compatibility with list of dicts tables
+    def __getitem__(self, key):
+        try:
+            return getattr(self, TrackItRow.KEYS[key])
+        except KeyError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, TrackItRow.KEYS[key], value)
+        if key == "valuetype":
+            self.vtype = value.lower() if isinstance(value, str) else ""
+        elif key == "comment" and value is None:
+            self.comment = ""
+
+    def __contains__(self, key):
+        return key in TrackItRow.KEYS and getattr(self, TrackItRow.KEYS[key]) is not None
+
+    def get(self, key, default = None):
+        value = getattr(self, TrackItRow.KEYS[key], None) if key in TrackItRow.KEYS else None
+        return default if value is None else value
+
+    def __repr__(self):
+        return f"TrackItRow({self.name!r}, {self.values!r}, {self.valuetype!r})"
+
+
+class TrackItTable(list):
+    '''
+        List of TrackItRow for one of the params, dtypes or meas tables.
+
+        Attributes:
+            kind
+                "params", "dtypes" or "meas" - selects the coercion rules
+            by_device
+                dict of MeasuringDevice --> rows, in table order
+    '''
+    __slots__ = ("kind", "by_device")
+
+    def __init__(self, rows = None, kind = None):
+        super().__init__(
+            TrackItTable.coerce(
+                row if isinstance(row, TrackItRow) else TrackItRow.from_dict(row),
+                kind,
+            )
+            for row in rows or ()
+        )
+        self.kind = kind
+        for i, row in enumerate(self):
+            row.index = i
+        self.regroup()
+
+    @classmethod
+    def from_rows(cls, rows, kind = None):
+        '''
+            rows as a TrackItTable, without copying if it already is one.
+        '''
+        if isinstance(rows, cls):
+            return rows
+        return cls(rows, kind = kind)
+
+    def regroup(self):
+        '''
+            Rebuild by_device, call after changing a row's MeasuringDevice.
+        '''
+        self.by_device = {}
+        for row in self:
+            self.by_device.setdefault(row.measuringdevice, []).append(row)
+
+    # -- static methods -- not dependent on object state
+    @staticmethod
+    def coerce(row, kind = None):
+        '''
+            Convert a row's value to its TRACK-IT valuetype, once.
+        '''
+        if row.blank:
+            return row
+        try:
+            if row.vtype == "long" and kind in ("dtypes", "meas") and type(row.values) is not int:
+                row.values = int(row.values)
+            elif row.vtype == "double" and kind == "meas" and isinstance(row.values, str):
+                row.values = float(row.values)
+        except (TypeError, ValueError):
+            pass # left for the validator to report
+        return row
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+The PTWTrackItTemplate class is a compiled, reusable skeleton of a TRACK-IT document.
+
+MPC records and spreadsheet templates produce the same document structure every
+time - the same DataTypes, MeasuringDevices, Parameters and unit/valuetype
+branches - and only the values change. A template is compiled once per schema
+by running the normal PTWTrackItXML build with numbered markers in place of
+the values. The rendered string is split at the markers into static parts.
+
+Rendering a new record then only fills the value slots and joins the strings:
+no tree walk, no tag formatting and no per-row branching.
+
+Templates are cached process-wide, keyed by the schema of the record:
+    - name, valuetype, unit, definition and measuringdevice of every row
+    - which rows are blank (blank rows are left out of the document)
+    - which optional elements are present (comments, positions, ...)
+    - indented or compact output
+The cache keeps the max_templates most recently used templates, so a long
+running service whose configs change drops the templates of old schemas.
+
+The output is identical to PTWTrackItXML.print_xml for the same record.
+
+Measurement templates cover a single Measurement element of one
+MeasuringDevice, with the guid and reference ids as extra slots. They are
+used by PTWTrackItBatchXML.stream_xml, where many records with the same
+schema share one document.
+
+Example usage:
+
+    template = PTWTrackItTemplate.for_record(ptw_xml)
+    template.print_xml(ptw_xml)
+
+    fragment = PTWTrackItTemplate.for_measurement(ptw_xml, "MPC - Beam").render(
+        ptw_xml, guid = guid, radiation_unit_ref = "2", measuring_software_ref = "1")
+
+"""
+
+import os
+import re
+from collections import OrderedDict
+from threading import Lock
+from logging import INFO, ERROR
+from io import StringIO
+from modules.ptw_xml import PTWTrackItXML
+from modules.xml_writer import XMLStreamWriter
+from modules.ptw_records import TrackItTable
+
+
+class PTWTrackItTemplate():
+    max_templates = 256 # schemas kept in the cache, least recently used dropped first
+    _templates = OrderedDict() # process-wide cache keyed by schema_key
+    _lock = Lock()
+    _marker = re.compile("\x00([0-9]+)\x00")
+
+    def __init__(self, parts, slots):
+        '''
+            parts - static strings, one more than there are slots
+            slots - callables that take a PTWTrackItXML and the extra values
+                    given to render (a dict), and return the formatted,
+                    escaped value for that position
+        '''
+        self._parts = parts
+        self._slots = slots
+
+    @classmethod
+    def for_record(cls, ptw_xml: PTWTrackItXML, compact = False):
+        '''
+            Cached template for the schema of ptw_xml, compiled on first use.
+        '''
+        key = PTWTrackItTemplate.schema_key(ptw_xml, compact)
+        return cls._cached(key, lambda: cls.compile(ptw_xml, compact))
+
+    @classmethod
+    def for_measurement(cls, ptw_xml: PTWTrackItXML, measuring_device, compact = False, depth = 3):
+        '''
+            Cached template of the Measurement element of ptw_xml for one
+            MeasuringDevice, indented for depth open elements
+            (PTW / Content / Measurements).
+        '''
+        key = (PTWTrackItTemplate.schema_key(ptw_xml, compact), "Measurement", measuring_device, depth)
+        return cls._cached(key, lambda: cls.compile_measurement(ptw_xml, measuring_device, compact, depth))
+
+    @classmethod
+    def _cached(cls, key, build):
+        '''
+            Template for key from the cache, or from build() if it is not
+            there. Least recently used templates beyond max_templates are dropped.
+        '''
+        with cls._lock:
+            template = cls._templates.get(key)
+            if template is not None:
+                cls._templates.move_to_end(key)
+                return template
+        template = build()
+        with cls._lock:
+            cls._templates[key] = template
+            while len(cls._templates) > cls.max_templates:
+                cls._templates.popitem(last = False)
+        return template
+
+    @classmethod
+    def compile(cls, ptw_xml: PTWTrackItXML, compact = False):
+        '''
+            Render ptw_xml with markers in place of its values and split the
+            result into static parts and value slots.
+        '''
+        probe = _TemplateProbe(ptw_xml)
+        buffer = StringIO()
+        probe._build_xml(*XMLStreamWriter(buffer, compact = compact).ttl())
+        return cls.split(buffer.getvalue(), probe)
+
+    @classmethod
+    def compile_measurement(cls, ptw_xml: PTWTrackItXML, measuring_device, compact = False,
+                            depth = 3):
+        '''
+            As compile, for the Measurement element of one MeasuringDevice.
+            The guid and reference ids are slots filled from the extra values
+            given to render.
+        '''
+        probe = _TemplateProbe(ptw_xml)
+        buffer = StringIO()
+        writer = XMLStreamWriter(buffer, compact = compact)
+        writer._open = [False] * depth # as if inside the enclosing elements
+        probe._xml_measurement(
+            writer.tag, writer.text, writer.line, measuring_device,
+            guid = probe._value_slot("guid"),
+            radiation_unit_ref = probe._value_slot("radiation_unit_ref"),
+            measuring_software_ref = probe._value_slot("measuring_software_ref"),
+        )
+        return cls.split(buffer.getvalue(), probe)
+
+    @classmethod
+    def split(cls, rendered, probe):
+        tokens = cls._marker.split(rendered)
+        return cls(
+            parts = tokens[0::2],
+            slots = [probe._slots[int(n)] for n in tokens[1::2]],
+        )
+
+    def render(self, ptw_xml: PTWTrackItXML, **values):
+        '''
+            The xml string for ptw_xml. values fill the extra slots of a
+            Measurement template: guid, radiation_unit_ref, measuring_software_ref.
+        '''
+        parts = self._parts
+        out = [parts[0]]
+        for slot, part in zip(self._slots, parts[1:]):
+            out.append(slot(ptw_xml, values))
+            out.append(part)
+        return "".join(out)
+
+    def print_xml(self, ptw_xml: PTWTrackItXML, f_path = None):
+        '''
+            Commit the rendered xml to file, as PTWTrackItXML.print_xml.
+        '''
+        if f_path is None:
+            f_path = os.path.join(ptw_xml.f_root,"xml")
+        ptw_xml._f_out = os.path.normpath(os.path.join(f_path,ptw_xml._fname+".xml"))
+        try:
+            with open(ptw_xml._f_out, "w") as o:
+                o.write(self.render(ptw_xml))
+            ptw_xml._log(INFO, "xml file generated from template: %s", ptw_xml._f_out)
+        except IOError as e:
+            ptw_xml._log(ERROR, "Could not generate xml: %s", e)
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._lock:
+            cls._templates.clear()
+
+    # -- static methods -- not dependent on object state
+    @staticmethod
+    def schema_key(ptw_xml: PTWTrackItXML, compact = False):
+        '''
+            Everything that shapes the document apart from the values themselves.
+        '''
+        return (
+            compact,
+            ptw_xml._line0, ptw_xml._ptw, ptw_xml._version, ptw_xml._author,
+            bool(ptw_xml.comment), bool(ptw_xml.params), bool(ptw_xml.meas),
+            tuple(
+                (row.name, row.valuetype, row.unit or None, row.blank)
+                for row in ptw_xml.params
+            ),
+            tuple(
+                (row.name, row.valuetype, row.definition, row.unit or None,
+                 row.measuringdevice, row.blank, bool(row.comment))
+                for row in ptw_xml.dtypes
+            ),
+            tuple(
+                (row.name, row.valuetype, row.unit or None, row.blank,
+                 row.positions is not None, row.positionunit or None)
+                for row in ptw_xml.meas
+            ),
+        )
+
+
+class _TemplateProbe(PTWTrackItXML):
+    '''
+        Stand-in record used by PTWTrackItTemplate.compile.
+        Has the same rows as the source record, but every value is written as
+        a numbered marker. Each marker records how to format the value of
+        that position for any record sharing the schema.
+    '''
+    def __init__(self, ptw_xml: PTWTrackItXML):
+        # PTWTrackItXML.__init__ is skipped on purpose, the rows are already converted
+        self.record_log = False
+        self._xml_build_log = []
+        self._slots = []
+        text, attr = XMLStreamWriter.text_escape, XMLStreamWriter.attr_escape
+
+        self._line0 = ptw_xml._line0
+        self._ptw = ptw_xml._ptw
+        self._version = ptw_xml._version
+        self._author = ptw_xml._author
+
+        self._fname = self._slot(lambda r: attr(r._fname))
+        self.machineID = self._slot(lambda r: text(r.machineID))
+        self.comment = self._slot(lambda r: text(r.comment)) if ptw_xml.comment else ptw_xml.comment
+        self.information = {
+            "source": self._slot(lambda r: text(r.information["source"])),
+            "author": ptw_xml.information["author"],
+        }
+
+        self.params = _TemplateProbe.indexed(ptw_xml.params)
+        self.dtypes = _TemplateProbe.indexed(ptw_xml.dtypes)
+        for row in self.dtypes:
+            if row.comment:
+                row.comment = self._slot(
+                    lambda r, i=row.index: text(r.dtypes[i].comment))
+        self.meas = _TemplateProbe.indexed(ptw_xml.meas)
+
+    def _log(self, level, msg, *args):
+        pass # marker values are not worth logging
+
+    def _logs(self, level):
+        return False
+
+    def _slot(self, formatter):
+        '''
+            Marker for a value of the record, formatted by formatter(record).
+        '''
+        self._slots.append(lambda r, values: formatter(r))
+        return f"\x00{len(self._slots) - 1}\x00"
+
+    def _value_slot(self, name):
+        '''
+            Marker for an attribute value given to render, e.g. the guid.
+        '''
+        attr = XMLStreamWriter.attr_escape
+        self._slots.append(lambda r, values: attr(values[name]))
+        return f"\x00{len(self._slots) - 1}\x00"
+
+    # -- value formatters -- write markers instead of values
+    def _date_value(self):
+        return self._slot(lambda r: r._date_value())
+
+    def _param_value(self, row):
+        text = XMLStreamWriter.text_escape
+        return self._slot(lambda r, i=row.index: text(r._param_value(r.params[i])))
+
+    def _analysis_value(self, row):
+        text = XMLStreamWriter.text_escape
+        return self._slot(lambda r, i=row.index: text(r._analysis_value(r.dtypes[i])))
+
+    def _meas_value(self, row):
+        # base64 alphabet, nothing to escape
+        return self._slot(lambda r, i=row.index: r._meas_value(r.meas[i]))
+
+    def _positions_value(self, row):
+        return self._slot(lambda r, i=row.index: r._positions_value(r.meas[i]))
+
+    def _author_value(self):
+        return self._slot(lambda r: r._author_value())
+
+    @staticmethod
+    def indexed(table):
+        '''
+            Copy of each row, keeping its position in the source table.
+            Non-blank values are replaced, they never reach the output.
+        '''
+        return TrackItTable(
+            [row.copy(values = row.values if row.blank else "-") for row in table]
+        )
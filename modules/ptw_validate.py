@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-flight checks of a PTWTrackItXML record against the TRACK-IT xml format
+rules (see TRACK-IT XML Structure in the README), before any xml is generated
+or the export tool is started.
+
+A single pass over the params, dtypes and meas tables reports every problem
+at once, for example:
+
+    - blank RadiationUnit, no AnalysisValues
+    - a ValueType that is not allowed for the table
+    - a missing TRACK-IT name, Definition or MeasuringDevice
+    - Double values that are not numbers, Long values int() fails on
+    - Booleans that did not convert, malformed Area "XxY" parameters
+    - Profile / PDD values that are not numbers, or positions of the wrong length
+    - an AnalysisValue name used twice (DataType ids must be unique)
+
+Blank values are not errors, they are left out of the document.
+
+Example usage:
+
+    issues = PTWTrackItValidator.validate(ptw_xml)
+    if issues:
+        print("\\n".join(str(issue) for issue in issues))
+
+    valid, rejected = PTWTrackItValidator.split(records)
+
+"""
+
+import re
+from math import isfinite
+from numbers import Integral, Real
+
+# ValueTypes allowed in each table, lower case
+PARAM_TYPES = frozenset(("string", "boolean", "long", "double", "area", "modality"))
+MEAS_TYPES = frozenset(("string", "boolean", "long", "double", "profile", "pdd", "userdefined"))
+DTYPE_TYPES = frozenset(("boolean", "long", "double"))
+
+AREA = re.compile(r"^\s*\d+(\.\d+)?\s*[xX]\s*\d+(\.\d+)?\s*$")
+
+
+class ValidationIssue():
+    '''
+        One problem found by PTWTrackItValidator.
+
+        Attributes:
+            table   - "record", "params", "dtypes" or "meas"
+            index   - row number in the table, None for record level issues
+            name    - TRACK-IT name of the row, if known
+            message - description of the problem
+    '''
+    __slots__ = ("table", "index", "name", "message")
+
+    def __init__(self, table, index, name, message):
+        self.table = table
+        self.index = index
+        self.name = name
+        self.message = message
+
+    def __str__(self):
+        if self.index is None:
+            return self.message
+        return f"{self.table} row {self.index + 1} ({self.name}): {self.message}"
+
+    def __repr__(self):
+        return f"ValidationIssue({self.table!r}, {self.index!r}, {self.name!r}, {self.message!r})"
+
+
+class PTWTrackItValidator():
+
+    # -- static methods -- not dependent on object state
+    @staticmethod
+    def validate(ptw_xml):
+        '''
+            All the problems with ptw_xml, as a list of ValidationIssue.
+            An empty list means the record can be generated and exported.
+        '''
+        issues = []
+        if not ptw_xml.machineID or not str(ptw_xml.machineID).strip():
+            issues.append(ValidationIssue("record", None, None, "RadiationUnit is blank"))
+
+        check = PTWTrackItValidator.check_value
+        for row in ptw_xml.params or ():
+            if not row.blank:
+                PTWTrackItValidator.check_row(issues, "params", row, PARAM_TYPES)
+                check(issues, "params", row)
+
+        names = set()
+        analysis_values = 0
+        for row in ptw_xml.dtypes or ():
+            if row.blank:
+                continue
+            analysis_values += 1
+            PTWTrackItValidator.check_row(issues, "dtypes", row, DTYPE_TYPES)
+            if row.definition is None or str(row.definition).strip() == "":
+                issues.append(ValidationIssue("dtypes", row.index, row.name, "Definition is blank"))
+            if row.measuringdevice is None or str(row.measuringdevice).strip() == "":
+                issues.append(ValidationIssue("dtypes", row.index, row.name, "MeasuringDevice is blank"))
+            if row.name in names:
+                issues.append(ValidationIssue("dtypes", row.index, row.name, "name is used twice"))
+            names.add(row.name)
+            check(issues, "dtypes", row)
+        if not analysis_values:
+            issues.append(ValidationIssue("record", None, None, "no AnalysisValues with a value"))
+
+        for row in ptw_xml.meas or ():
+            if not row.blank:
+                PTWTrackItValidator.check_row(issues, "meas", row, MEAS_TYPES)
+                check(issues, "meas", row)
+
+        return issues
+
+    @staticmethod
+    def split(records):
+        '''
+            Separate records into (valid, rejected), where rejected is a list
+            of (record, issues) pairs.
+        '''
+        valid, rejected = [], []
+        for record in records:
+            issues = PTWTrackItValidator.validate(record)
+            if issues:
+                rejected.append((record, issues))
+            else:
+                valid.append(record)
+        return valid, rejected
+
+    @staticmethod
+    def check_row(issues, table, row, allowed):
+        if row.name is None or str(row.name).strip() == "":
+            issues.append(ValidationIssue(table, row.index, row.name, "TRACK-IT name is blank"))
+        if row.vtype not in allowed:
+            issues.append(ValidationIssue(
+                table, row.index, row.name,
+                f"ValueType {row.valuetype!r} is not one of {', '.join(sorted(allowed))}"))
+
+    @staticmethod
+    def check_value(issues, table, row):
+        '''
+            Check a non-blank value against its ValueType, as converted by
+            PTWTrackItXML and TrackItTable.
+        '''
+        vtype, value = row.vtype, row.values
+        message = None
+        if vtype == "double":
+            if not PTWTrackItValidator.is_number(value):
+                message = f"Double value {value!r} is not a number"
+        elif vtype == "long":
+            if table == "params":
+                try:
+                    int(value)
+                except (TypeError, ValueError):
+                    message = f"Long value {value!r} is not a whole number"
+            elif not isinstance(value, Integral):
+                message = f"Long value {value!r} is not a whole number"
+        elif vtype == "boolean":
+            if table == "dtypes" and value not in (0, 1, 2, "0", "1", "2"):
+                message = f"Boolean value {value!r} is not Pass, Fail or Warning"
+            elif table == "meas" and not isinstance(value, Integral):
+                message = f"Boolean value {value!r} is not Yes or No"
+        elif vtype == "string" and table == "meas":
+            if not isinstance(value, str):
+                message = f"String value {value!r} is not text"
+        elif vtype == "area":
+            if not AREA.match(str(value)):
+                message = f'Area value {value!r} is not in the form "XxY"'
+        elif vtype in ("profile", "pdd"):
+            message = PTWTrackItValidator.check_array(row)
+        if message:
+            issues.append(ValidationIssue(table, row.index, row.name, message))
+
+    @staticmethod
+    def check_array(row):
+        '''
+            Profile / PDD values: a list or buffer of numbers, with positions
+            of the same length when given.
+        '''
+        values = row.values
+        try:
+            n = len(values)
+            if not isinstance(values, (list, tuple)):
+                memoryview(values) # arrays and other buffers
+        except TypeError:
+            return f"{row.valuetype} values are not a series of numbers"
+        if not n:
+            return f"{row.valuetype} has no values"
+        if isinstance(values, (list, tuple)) and not all(
+                isinstance(v, Real) and not isinstance(v, bool) for v in values):
+            return f"{row.valuetype} values are not all numbers"
+        if row.positions is not None:
+            try:
+                if len(row.positions) != n:
+                    return f"{len(row.positions)} positions for {n} {row.valuetype} values"
+            except TypeError:
+                return "positions are not a series of numbers"
+        return None
+
+    @staticmethod
+    def is_number(value):
+        '''
+            True for finite numbers and strings that float() reads as one.
+        '''
+        if isinstance(value, bool):
+            return False
+        if isinstance(value, Real):
+            return isfinite(value)
+        try:
+            return isfinite(float(value))
+        except (TypeError, ValueError):
+            return False
@@ -3,18 +3,20 @@
 The PTWTrackItXML is the work horse class of the TrackItApp. 
 The main methods are: 
     generate_xml - yattag Doc class, with PTW specific formatting 
+    stream_xml - writes the same document straight to an open stream 
     print_xml - commits the xml content to memory 
 
 It is initialised with the following kwargs:
     comment:            TRACK-IT Comment 
     deviceID:           TRACK-IT MeasuringDevice
     machineID:          TRACK-IT RadiationID
-    params:             TRACK-IT Parameters as list of python dicts
-    dtypes:             TRACK-IT DataTypes as list of python dicts 
-    meas:               TRACK-IT Measurements list of python dicts
+    params:             TRACK-IT Parameters as list of python dicts or TrackItTable
+    dtypes:             TRACK-IT DataTypes as list of python dicts or TrackItTable
+    meas:               TRACK-IT Measurements list of python dicts or TrackItTable
     information:        python dict used to keep track of the TRACK-IT data origin
     measurement_date:   python datetime object 
     import_client_path: path to PTW ExportToDatabase.exe  
+    record_log:         keep the per-record build log for build_xml_log (default False) 
     
 Dependencies: 
     yattag v1.14
@@ -30,8 +32,17 @@ from yattag import Doc, indent # formatting xmls
 from datetime import datetime,timezone # generating UID
 from struct import pack # for packing floats and ints into 64-bit string 
 from base64 import b64encode # raw data needs to be 64-bit encoded
+from hashlib import sha256 # content hash for the sent index 
+from array import array # Profile and PDD values 
 import os
-from subprocess import run
+import sys
+from modules.xml_writer import XMLStreamWriter
+from modules.ptw_records import TrackItTable
+from modules.ptw_logging import get_logger
+from modules.ptw_export import PTWExportPool
+from logging import DEBUG, INFO, ERROR
+
+_logger = get_logger("ptw_xml")
 
 class PTWTrackItXML():
     def __init__(self, 
@@ -43,24 +54,34 @@ class PTWTrackItXML():
                  information,
                  measurement_date = None,
                  import_client_path = os.path.normpath("//mosaiqapp-20/MOSAIQ_APP/TOOLS/TRACK-IT/ExportToDatabase/TrackitExporter.exe"),
+                 record_log = False,
                  *args, **kwargs):
+        self.record_log = record_log
         self._xml_build_log = []
         self.comment = comment
         self.machineID = machineID
         self.meas_date = measurement_date
+        self._created = datetime.now()
+        # record identifier, used in file names, guids and log messages 
+        self._fname = "_".join([
+            information["author"].replace(" ","_"),
+            information["source"].replace(" ","_"),
+            self._created.strftime('%Y_%m_%d_%H_%M_%S'),
+            ])
         
-        # Before we build the xml, we apply the necessary boolean conversions 
+        # Tables are held as TrackItTable rows, type coerced once 
+        # and grouped by MeasuringDevice 
+        self.dtypes = TrackItTable.from_rows(dtypes, kind = "dtypes")
+        self.meas = TrackItTable.from_rows(meas, kind = "meas")
+        self.params = TrackItTable.from_rows(params, kind = "params")
 
-        self.dtypes = self.add_comments_column(dtypes)
-        self.dtypes = [
-            self.string_boolean_conversion(row) for row in self.dtypes
-        ]
-        self.meas = [
-            self.string_boolean_conversion(row) for row in meas
-        ]
-        self.params = [
-            self.param_boolean_conversion(row) for row in params
-        ]
+        # Before we build the xml, we apply the necessary boolean conversions 
+        for row in self.dtypes:
+            self.string_boolean_conversion(row)
+        for row in self.meas:
+            self.string_boolean_conversion(row)
+        for row in self.params:
+            self.param_boolean_conversion(row)
 
         self.information = information
         self._line0 = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
@@ -71,12 +92,6 @@ class PTWTrackItXML():
         self._version = "1.3"
         self.f_root = os.getcwd()
         
-        self._fname = "_".join([
-            information["author"].replace(" ","_"),
-            information["source"].replace(" ","_"),
-            datetime.now().strftime('%Y_%m_%d_%H_%M_%S'),
-            ])
-        
     def check_init(self): 
         ''' Useful self check method that returns true if non-empty
             machineID and deviceIDs are defined'''
@@ -90,27 +105,30 @@ class PTWTrackItXML():
             Generate the xml string using the yattag patterns. 
         '''
         self.track_it_xml, tag, text, line = Doc().ttl()  
-        self.track_it_xml.asis(self._line0)
+        self._build_xml(self.track_it_xml, tag, text, line)
+
+    def stream_xml(self, stream, compact = False):
+        '''
+            Write the xml straight to an open text stream as it is produced.
+            No Doc is held in memory and no second indent pass is needed. 
+            compact = True omits the indentation, matching Doc().getvalue().
+        '''
+        self._build_xml(*XMLStreamWriter(stream, compact = compact).ttl())
+
+    def _build_xml(self, doc, tag, text, line):
+        '''
+            Walk the TRACK-IT document using the yattag tag, text, line patterns.
+            Shared by generate_xml (yattag Doc) and stream_xml (XMLStreamWriter). 
+        '''
+        doc.asis(self._line0)
         with tag(self._ptw): # root
             line('Version',self._version)
             line('Author',self._author)
             
             with tag('Content'):
                 with tag('DataTypes'):
-                    self._xml_build_log.append('Processing DataTypes...')
-                    for row in self.dtypes:
-                        if row["values"] != '':
-                            self._xml_build_log.append(f"Found DataType: {row['track-it']} with value {row['values']}")
-                            with tag('DataType',id = row["track-it"]): 
-                                line('Name',row["track-it"])
-                                line('ValueType',row["valuetype"])
-                                line('Definition',row["definition"])
-                                if row["unit"]:
-                                    line('Unit',row["unit"])
-                        else:
-                            self._xml_build_log.append(f"Skipping DataType: {row['track-it']} because "
-                                  "value was blank")
-                            
+                    self._xml_data_types(tag, line)
+                        
                 # define RadiationUnits, we can only measure on 1 LINAC at a time 
                 with tag('RadiationUnits'):
                     with tag('RadiationUnit',id='1'): 
@@ -118,11 +136,7 @@ class PTWTrackItXML():
                         
                 # define MeasuringDevices
                 # as of version 1.2, we can have more than one of these per measurement 
-                set_of_measuring_devices = set (
-                    [
-                        row["measuringdevice"] for row in self.dtypes
-                    ]
-                )
+                set_of_measuring_devices = self.measuring_devices()
                 with tag('MeasuringDevices'):
                     for measuring_device in set_of_measuring_devices:
                         with tag('MeasuringDevice',id=measuring_device):
@@ -139,147 +153,248 @@ class PTWTrackItXML():
 
                     # enter loop through measuring devices 
                     for measuring_device in set_of_measuring_devices:
-                        self._xml_build_log.append('Looking at measurements with '+measuring_device)
-                        _dtypes = [row for row in self.dtypes if row["measuringdevice"]==measuring_device]
-
-                        with tag('Measurement',
-                                ('guid',"_".join([self._fname, measuring_device])), 
-                                ('radiation-unit-ref','1'), 
-                                ('measuring-software-ref','1'),
-                                ('measuring-device-ref',measuring_device)): 
-                            # associate with 1 LINAC as a time 
-                            
-                            # Measurement admin
-                            with tag('AdminData'):
-                                if self.meas_date:
-                                    line('Date', self.meas_date.replace(microsecond = 0, tzinfo=timezone.utc).isoformat())
-                                else:
-                                    line('Date', datetime.utcnow().replace(microsecond = 0, tzinfo=timezone.utc).isoformat()) 
-                                if self.comment:
-                                    line('Comment',self.comment) 
-                                
-                                # Measurement parameters
-                                if self.params:
-                                    self._xml_build_log.append('Processing Parameters...')
-                                    with tag('Parameters'): 
-                                        for row in self.params:
-                                            if row["values"] != '':
-                                                self._xml_build_log.append(f"Found Parameter: {row['track-it']} with value {row['values']}")
-                                                if row["unit"]: 
-                                                    with tag('Parameter', 
-                                                            name=row["track-it"], 
-                                                            valuetype=row["valuetype"],
-                                                            unit=row["unit"]):
-                                                        text(str(row["values"]))
-                                                else:
-                                                    with tag('Parameter', 
-                                                            name=row["track-it"], 
-                                                            valuetype=row["valuetype"]):
-                                                        text(str(row["values"]))
-                                        
-                                            else:
-                                                self._xml_build_log.append(f"Skipping Parameter: {row['track-it']} because "
-                                                    "value was blank")
+                        self._xml_measurement(tag, text, line, measuring_device)
+
+    def measuring_devices(self):
+        '''
+            Set of MeasuringDevices referenced by the DataTypes. 
+        '''
+        return set (self.dtypes.by_device)
+
+    def content_hash(self):
+        '''
+            Deterministic SHA-256 hex digest of the measurement content:
+            RadiationUnit, measurement date, Parameters and AnalysisValues.
+            File names, authors and export times are not included, so the same
+            data always gives the same hash. Used by PTWSentIndex.
+            A record without a measurement date is dated on export, so the day it
+            was created is hashed instead: the same values on another day, e.g. 
+            an all-Pass daily check, are a new measurement. 
+        '''
+        h = sha256()
+        if self.meas_date:
+            date = self.meas_date.replace(microsecond = 0).isoformat()
+        else:
+            date = "created " + self._created.date().isoformat()
+        for field in (self.machineID, date):
+            h.update(str(field).encode("utf-8") + b"\x1f")
+        for row in self.params:
+            if not row.blank:
+                h.update(f"P\x1e{row.name}\x1e{self._param_value(row)}\x1f".encode("utf-8"))
+        for row in self.dtypes:
+            if not row.blank:
+                h.update(f"D\x1e{row.measuringdevice}\x1e{row.name}\x1e"
+                         f"{self._analysis_value(row)}\x1f".encode("utf-8"))
+        for row in self.meas:
+            if not row.blank:
+                h.update(f"M\x1e{row.name}\x1e{self._meas_value(row)}\x1f".encode("utf-8"))
+        return h.hexdigest()
+
+    def _xml_data_types(self, tag, line, seen = None):
+        '''
+            DataType elements for each non-blank AnalysisValue. 
+            seen (optional) is a set of DataType ids already written, 
+            used to deduplicate definitions when several records share a document. 
+        '''
+        self._log(INFO, 'Processing DataTypes...')
+        log_rows = self._logs(DEBUG)
+        for row in self.dtypes:
+            if not row.blank:
+                if seen is not None:
+                    if row.name in seen:
+                        continue
+                    seen.add(row.name)
+                if log_rows: self._log(DEBUG, "Found DataType: %s with value %s", row.name, row.values)
+                with tag('DataType',id = row.name): 
+                    line('Name',row.name)
+                    line('ValueType',row.valuetype)
+                    line('Definition',row.definition)
+                    if row.unit:
+                        line('Unit',row.unit)
+            else:
+                if log_rows: self._log(DEBUG, "Skipping DataType: %s because "
+                      "value was blank", row.name)
+
+    def _xml_measurement(self, tag, text, line, measuring_device, 
+                         guid = None, radiation_unit_ref = '1', measuring_software_ref = '1'):
+        '''
+            One Measurement element for the AnalysisValues of a single MeasuringDevice. 
+            The guid and reference ids can be overridden when several records 
+            share a document. 
+        '''
+        if guid is None:
+            guid = "_".join([self._fname, measuring_device])
+
+        self._log(INFO, 'Looking at measurements with %s', measuring_device)
+        log_rows = self._logs(DEBUG)
+        _dtypes = self.dtypes.by_device.get(measuring_device, [])
+
+        with tag('Measurement',
+                ('guid',guid), 
+                ('radiation-unit-ref',radiation_unit_ref), 
+                ('measuring-software-ref',measuring_software_ref),
+                ('measuring-device-ref',measuring_device)): 
+            # associate with 1 LINAC as a time 
+            
+            # Measurement admin
+            with tag('AdminData'):
+                line('Date', self._date_value())
+                if self.comment:
+                    line('Comment',self.comment) 
+                
+                # Measurement parameters
+                if self.params:
+                    self._log(INFO, 'Processing Parameters...')
+                    with tag('Parameters'): 
+                        for row in self.params:
+                            if not row.blank:
+                                if log_rows: self._log(DEBUG, "Found Parameter: %s with value %s", row.name, row.values)
+                                if row.unit: 
+                                    with tag('Parameter', 
+                                            name=row.name, 
+                                            valuetype=row.valuetype,
+                                            unit=row.unit):
+                                        text(self._param_value(row))
                                 else:
-                                    self._xml_build_log.append('No parameters provided - nothing to process.')  
+                                    with tag('Parameter', 
+                                            name=row.name, 
+                                            valuetype=row.valuetype):
+                                        text(self._param_value(row))
+                        
+                            else:
+                                if log_rows: self._log(DEBUG, "Skipping Parameter: %s because "
+                                    "value was blank", row.name)
+                else:
+                    self._log(INFO, 'No parameters provided - nothing to process.')  
 
-                            # Analysis values - tracked longitudinally in TRACK-IT 
-                            self._xml_build_log.append('Processing AnalysisValues...')
-                    
-                            with tag('AnalyzeData'):
-                                for row in _dtypes:
-                                    if row["values"] != '':
-                                        self._xml_build_log.append(f'Found AnalysisValue: {row["track-it"]} with value: {row["values"]}')
-                                        with tag('AnalyzeValue',('data-type-ref',row["track-it"])):
-                                            if "long" in row["valuetype"].lower():
-                                                line('Value',int(row["values"])) # Integer
-                                            else:
-                                                line('Value',row["values"]) # Any other data format
-                                            if row["comment"]:
-                                                line('Comment',row["comment"])
-                                    else:
-                                        self._xml_build_log.append(f"Skipping AnalysisValue: {row['track-it']} because "
-                                        "value was blank")
-                            
-                            # Measurement specific values e.g. temperature, pressure, chamberID 
-                            with tag('MeasData'):
-                                if self.meas:
-                                    self._xml_build_log.append('Processing MeasData...')
-                                    for row in self.meas:
-                                        if row["values"] != '': 
-                                            self._xml_build_log.append(f'Found MeasData: {row["track-it"]} with value: {row["values"]}')
-                                            with tag('MeasValues',
-                                                    ('name',row["track-it"]),
-                                                    ('type',row["valuetype"]),
-                                                    ):
-                                                if row["unit"]:
-                                                    line('Values',
-                                                        PTWTrackItXML.b64_method(
-                                                            row["values"],
-                                                            row["valuetype"]),
-                                                            unit=row["unit"]
-                                                        )
-                                                else:
-                                                    line('Values',
-                                                        PTWTrackItXML.b64_method(
-                                                            row["values"],
-                                                            row["valuetype"]
-                                                            )
-                                                        )
-                                        
-                                        else:
-                                            self._xml_build_log.append(f"Skipping Measurement: {row['track-it']} because "
-                                            "value was blank")
+            # Analysis values - tracked longitudinally in TRACK-IT 
+            self._log(INFO, 'Processing AnalysisValues...')
+    
+            with tag('AnalyzeData'):
+                for row in _dtypes:
+                    if not row.blank:
+                        if log_rows: self._log(DEBUG, 'Found AnalysisValue: %s with value: %s', row.name, row.values)
+                        with tag('AnalyzeValue',('data-type-ref',row.name)):
+                            line('Value',self._analysis_value(row))
+                            if row.comment:
+                                line('Comment',row.comment)
+                    else:
+                        if log_rows: self._log(DEBUG, "Skipping AnalysisValue: %s because "
+                        "value was blank", row.name)
+            
+            # Measurement specific values e.g. temperature, pressure, chamberID 
+            with tag('MeasData'):
+                if self.meas:
+                    self._log(INFO, 'Processing MeasData...')
+                    for row in self.meas:
+                        if not row.blank: 
+                            if log_rows and PTWTrackItXML.is_array_type(row.vtype):
+                                self._log(DEBUG, 'Found MeasData: %s with %d points', row.name, len(row.values))
+                            elif log_rows:
+                                self._log(DEBUG, 'Found MeasData: %s with value: %s', row.name, row.values)
+                            with tag('MeasValues',
+                                    ('name',row.name),
+                                    ('type',row.valuetype),
+                                    ):
+                                if row.unit:
+                                    line('Values', self._meas_value(row), unit=row.unit)
                                 else:
-                                    self._xml_build_log.append('No Measurements to process.')
-                                    
-                                with tag('MeasValues',
-                                        ('name',"Measured by"),
-                                        ('type',"String"),
-                                        ):
-                                    line('Values',
-                                        PTWTrackItXML.b64_method(self.information["author"], "String")
-                                        )
+                                    line('Values', self._meas_value(row))
+                                # Profile and PDD may carry positions, one per value 
+                                if row.positions is not None:
+                                    if row.positionunit:
+                                        line('Positions', self._positions_value(row), unit=row.positionunit)
+                                    else:
+                                        line('Positions', self._positions_value(row))
+                        
+                        else:
+                            if log_rows: self._log(DEBUG, "Skipping Measurement: %s because "
+                            "value was blank", row.name)
+                else:
+                    self._log(INFO, 'No Measurements to process.')
+                    
+                with tag('MeasValues',
+                        ('name',"Measured by"),
+                        ('type',"String"),
+                        ):
+                    line('Values', self._author_value())
+
+    # -- value formatters -- the only places record values enter the document 
+    def _date_value(self):
+        if self.meas_date:
+            return self.meas_date.replace(microsecond = 0, tzinfo=timezone.utc).isoformat()
+        return datetime.utcnow().replace(microsecond = 0, tzinfo=timezone.utc).isoformat()
+
+    def _param_value(self, row):
+        return str(row.values)
+
+    def _analysis_value(self, row):
+        if "long" in row.vtype:
+            return int(row.values) # Integer, already coerced by TrackItTable
+        return row.values # Any other data format
+
+    def _meas_value(self, row):
+        return PTWTrackItXML.b64_method(row.values, row.vtype)
+
+    def _positions_value(self, row):
+        return PTWTrackItXML.convert_to_b64_alphabet(
+            PTWTrackItXML.pack_doubles(row.positions))
+
+    def _author_value(self):
+        return PTWTrackItXML.b64_method(self.information["author"], "String")
     
-    def print_xml(self, f_path = None):
+    def print_xml(self, f_path = None, stream = False, compact = False):
         ''' 
             Commit the xml string to file. 
+            stream = True writes elements to file as they are generated,
+            generate_xml does not need to be called first.
+            compact = True skips the indentation pass.
         '''
         if f_path is None:
             f_path = os.path.join(self.f_root,"xml")
         self._f_out = os.path.normpath(os.path.join(f_path,self._fname+".xml"))
         try: 
             with open(self._f_out, "w") as o:
-                o.write(indent(self.track_it_xml.getvalue()))
-            self._xml_build_log.append(f"xml file generated: {self._f_out}")
+                if stream:
+                    self.stream_xml(o, compact = compact)
+                elif compact:
+                    o.write(self.track_it_xml.getvalue())
+                else:
+                    o.write(indent(self.track_it_xml.getvalue()))
+            self._log(INFO, "xml file generated: %s", self._f_out)
         except (IOError, AttributeError) as e:
-            self._xml_build_log.append(f"Could not generate xml: {e}")
+            self._log(ERROR, "Could not generate xml: %s", e)
             
         
-    def export_xml(self):
+    def export_xml(self, pool = None):
         '''
             Export the xml to TRACK-IT using the PTW Export tool. 
             Appends the command to the log file. 
+            pool (optional) PTWExportPool, default is a single job with retries
+            and the exporter output left on the console. 
+            Returns the process return code, None if it timed out. 
         '''
-        ptw_cmd = " ".join([
-                            self.import_client_path,
-                            "-i",
-                            self._f_out,
-                            "-o",
-                            self._track_it_ip,
-                            ])
+        f_out, ptw_cmd = PTWExportPool.command(
+            self.import_client_path, self._f_out, self._track_it_ip)
         
-        self._xml_build_log.append('Sending to TRACK-IT via HTTPS')
+        self._log(INFO, 'Sending to TRACK-IT via HTTPS')
+        self._log(INFO, "%s", " ".join(ptw_cmd))
         
-        run(ptw_cmd, capture_output =False, )
+        pool = pool or PTWExportPool(max_workers = 1, capture_output = False)
+        result = pool.export_one(f_out, ptw_cmd)
         
-        self._xml_build_log.append(ptw_cmd)
+        self._log(INFO if result.ok else ERROR,
+                  "TRACK-IT Export Process return code: %s %s", result.returncode, result.error)
+        return result.returncode
                        
             
     def build_xml_log(self):
         ''' 
             Print the basic log file list to .log file. 
+            Only when the per-record log is enabled with record_log = True. 
         '''
+        if not self.record_log:
+            return
         f_path = os.path.normpath(os.path.join(
             self.f_root,
             "log",
@@ -290,17 +405,24 @@ class PTWTrackItXML():
         with open(f_path, 'w') as w:
             w.writelines([line+"\n" for line in self._xml_build_log])
     
-    def add_comments_column(self, table):
+    def _log(self, level, msg, *args):
         '''
-            Some legacy spreadsheets AnalysisValues do not have a comment column. 
-            This needs adding to ensure backward compatability. 
+            Lazy, leveled build log. 
+            The message is only formatted if the shared ptw_tools logger will emit it,
+            or if the per-record log is enabled. 
         '''
-        for row in table:
-            if not "comment" in row:
-                row["comment"]= ""
-        return table
-            
-         
+        if self.record_log:
+            self._xml_build_log.append(msg % args if args else str(msg))
+        if _logger.isEnabledFor(level):
+            _logger.log(level, "%s: " + str(msg), self._fname, *args)
+
+    def _logs(self, level):
+        '''
+            True if a message at level would go anywhere. 
+            Used to skip per-row messages entirely in the generation loop. 
+        '''
+        return self.record_log or _logger.isEnabledFor(level)
+
     def string_boolean_conversion(self, row):
         ''' 
             Row wise Boolean conversion for dtypes and meas. 
@@ -318,8 +440,8 @@ class PTWTrackItXML():
         '''
         if isinstance(row["values"],str) and "bool" in row["valuetype"].lower():
 
-            self._xml_build_log.append(
-                f"Applying boolean conversion method to {row['track-it']} with value: {row['values']}"
+            self._log(DEBUG,
+                "Applying boolean conversion method to %s with value: %s", row['track-it'], row['values']
                 )
 
             if any(substring in row["values"].lower() for substring in ["p","t","y"]):
@@ -345,8 +467,8 @@ class PTWTrackItXML():
         '''
         if "bool" in row["valuetype"].lower():
             if isinstance(row["values"],str):
-                self._xml_build_log.append(
-                    f"Applying boolean conversion method to {row['track-it']} with value: {row['values']}"
+                self._log(DEBUG,
+                    "Applying boolean conversion method to %s with value: %s", row['track-it'], row['values']
                     )
                 if any(substring in row["values"].lower() for substring in ["p","t","y"]):
                     row["values"] = "True"
@@ -390,4 +512,46 @@ class PTWTrackItXML():
         elif val_type=='long' or val_type=='boolean' : 
             # for ints and bools we need to use integer C type 
             val = pack('<q',val)
+        elif PTWTrackItXML.is_array_type(val_type):
+            # Profile and PDD are double arrays, packed in one go 
+            val = PTWTrackItXML.pack_doubles(val)
         return PTWTrackItXML.convert_to_b64_alphabet(val)
+
+    @staticmethod
+    def pack_doubles(values):
+        '''
+            Pack a series of values as little-endian 64-bit doubles, as required 
+            by TRACK-IT for Profile and PDD measurements. 
+            
+            Accepts NumPy arrays, array.array, any buffer of doubles, 
+            or a list/tuple of numbers. 
+            Contiguous little-endian double buffers are returned as a zero-copy 
+            memoryview, everything else is converted in a single bulk operation. 
+            There is no per-point python loop. 
+        '''
+        numpy = sys.modules.get("numpy") # optional, only present if the caller uses it 
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            values = numpy.ascontiguousarray(values, dtype='<f8')
+            return memoryview(values).cast('B')
+
+        if isinstance(values, (list, tuple)):
+            return pack(f'<{len(values)}d', *values)
+
+        if isinstance(values, array) and values.typecode != 'd':
+            values = array('d', values)
+
+        view = memoryview(values)
+        if view.format != 'd' or not view.c_contiguous:
+            view = memoryview(array('d', view.tolist()))
+        if sys.byteorder == 'little':
+            return view.cast('B')
+        swapped = array('d', view)
+        swapped.byteswap()
+        return memoryview(swapped).cast('B')
+
+    @staticmethod
+    def is_array_type(val_type):
+        '''
+            True for the TRACK-IT measurement types that hold a series of values.
+        '''
+        return val_type.lower() in ('profile', 'pdd')
@@ -32,6 +32,8 @@
 
 from pylightxl import readxl
 from modules.ptw_xml import PTWTrackItXML
+from modules.ptw_validate import PTWTrackItValidator
+from modules.ptw_records import TrackItTable, TrackItRow
 from re import sub
 
 class TrackItSheet():
@@ -40,9 +42,9 @@ class TrackItSheet():
         If successful, the object will have the following attributes:
             comment - Named range called Comment 
             machineID - Named range called RadiationID
-            params - TRACK-IT Parameters as python dict
-            dtypes - TRACK-IT DataTypes as python dict 
-            meas - TRACK-IT Measurements as python dict 
+            params - TRACK-IT Parameters as TrackItTable
+            dtypes - TRACK-IT DataTypes as TrackItTable 
+            meas - TRACK-IT Measurements as TrackItTable 
             information - python dict used to keep track of the things like author & software 
             ptw_xml - instance of the ptw_xml class based on the information above 
             _status - used for debugging 
@@ -68,7 +70,7 @@ class TrackItSheet():
         if self.db:
             try: 
                 self.machineID = self.db.nr(name="RadiationUnit")[0][0].strip()
-                self.dtypes = TrackItSheet.dict_from_xltable(self.db.nr(name="AnalysisValues"))
+                self.dtypes = TrackItSheet.dict_from_xltable(self.db.nr(name="AnalysisValues"), kind = "dtypes")
             except:
                 self._status = False
                 self._error_message = (
@@ -101,12 +103,12 @@ class TrackItSheet():
                 self.comment = ''
                 
             try:
-                self.params = TrackItSheet.dict_from_xltable(self.db.nr(name="Parameters"))
+                self.params = TrackItSheet.dict_from_xltable(self.db.nr(name="Parameters"), kind = "params")
             except:
                 self.params = None
 
             try:
-                self.meas = TrackItSheet.dict_from_xltable(self.db.nr(name="Measurements"))
+                self.meas = TrackItSheet.dict_from_xltable(self.db.nr(name="Measurements"), kind = "meas")
             except:
                 self.meas = None 
             
@@ -134,21 +136,36 @@ class TrackItSheet():
                  params=self.params,
                  dtypes=self.dtypes,
                  meas=self.meas,
-                 information=self.information)
+                 information=self.information,
+                 record_log=True)
             
                 # check the PTWTrackItXML build 
-                if self.ptw_xml.check_init():
+                issues = PTWTrackItValidator.validate(self.ptw_xml)
+                if issues:
+                    self._status = False
+                    self._error_message = "\n".join(
+                        ["Please correct the TRACK_IT sheet and try again:\n"]
+                        + [str(issue) for issue in issues[:15]]
+                        + ([f"... and {len(issues) - 15} more"] if len(issues) > 15 else [])
+                    )
+                elif self.ptw_xml.check_init():
                     self.ptw_xml.generate_xml() 
                 else:
                     self._status = False
                 
     @staticmethod     
-    def dict_from_xltable(xltable):
+    def dict_from_xltable(xltable, kind = None):
+        '''
+            Named range --> TrackItTable, the first row holds the column headings. 
+        '''
         heads = [item.strip().lower() for item in xltable[0]]
         body = xltable[1:]
         #body = [list(sublist) for sublist in list(zip(*body))]
-        return [{k:TrackItSheet.strip_white_space(v) 
-                 for k,v in zip(heads, row)} for row in body]
+        return TrackItTable(
+            [TrackItRow.from_values(heads, [TrackItSheet.strip_white_space(v) for v in row]) 
+             for row in body],
+            kind = kind
+        )
     
     @staticmethod
     def strip_white_space(arg):
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+The XMLStreamWriter is a streaming counterpart to the yattag Doc class.
+It exposes the same tag, text, line and asis patterns, but writes each element
+straight to an open file or stream instead of holding the whole document in memory.
+
+Two output modes are available:
+    indented (default) - byte-identical to yattag.indent(Doc().getvalue())
+    compact            - byte-identical to Doc().getvalue()
+
+The indented mode follows the yattag.indent defaults: two space indentation,
+'\\n' newlines and elements that directly contain text kept on a single line.
+Mixed content (text and child elements within the same element) is not
+supported - the PTW TRACK-IT format never requires it.
+
+Example usage:
+
+    with open("out.xml", "w") as o:
+        doc, tag, text, line = XMLStreamWriter(o).ttl()
+        with tag('PTW'):
+            line('Version', '1.3')
+
+"""
+
+from contextlib import contextmanager
+
+
+class XMLStreamWriter():
+    def __init__(self, stream, compact = False, indentation = '  ', newline = '\n'):
+        self.stream = stream
+        self.compact = compact
+        self._indentation = indentation
+        self._newline = newline
+        self._started = False
+        # one flag per open element: True once a child element has been written
+        self._open = []
+
+    def ttl(self):
+        '''
+            Mirrors yattag Doc().ttl() so the writer can be swapped in
+            for an existing build method.
+        '''
+        return self, self.tag, self.text, self.line
+
+    def asis(self, string):
+        '''
+            Write a raw string, e.g. the xml declaration, without escaping.
+        '''
+        self._start_node()
+        self.stream.write(string)
+
+    def text(self, content):
+        '''
+            Write an escaped text node inside the current element.
+        '''
+        self.stream.write(XMLStreamWriter.text_escape(content))
+
+    @contextmanager
+    def tag(self, tag_name, *args, **kwargs):
+        '''
+            Context manager that opens an element on entry and closes it on exit.
+            Attributes may be given as (key, value) tuples or keyword arguments.
+        '''
+        self._start_node()
+        self.stream.write(
+            "<" + tag_name + XMLStreamWriter.attributes(args, kwargs) + ">"
+        )
+        self._open.append(False)
+        try:
+            yield
+        finally:
+            if self._open.pop() and not self.compact:
+                self.stream.write(self._newline + self._indentation * len(self._open))
+            self.stream.write("</" + tag_name + ">")
+
+    def line(self, tag_name, text_content, *args, **kwargs):
+        '''
+            Shorthand for an element containing a single text node.
+        '''
+        with self.tag(tag_name, *args, **kwargs):
+            self.text(text_content)
+
+    def _start_node(self):
+        '''
+            Every node after the first starts on a new, indented line.
+        '''
+        if self._open:
+            self._open[-1] = True
+        if self._started and not self.compact:
+            self.stream.write(self._newline + self._indentation * len(self._open))
+        self._started = True
+
+    # -- static methods -- same escaping rules as yattag
+    @staticmethod
+    def text_escape(s):
+        if isinstance(s, (int, float)):
+            return str(s)
+        return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+    @staticmethod
+    def attr_escape(s):
+        if isinstance(s, (int, float)):
+            return str(s)
+        return s.replace("&", "&amp;").replace("<", "&lt;").replace('"', "&quot;")
+
+    @staticmethod
+    def attributes(args, kwargs):
+        '''
+            Render (key, value) tuples followed by keyword arguments,
+            in the order given, as an attribute string.
+        '''
+        pairs = [arg for arg in args if isinstance(arg, tuple)]
+        pairs.extend(kwargs.items())
+        return "".join(
+            ' %s="%s"' % (key, XMLStreamWriter.attr_escape(value))
+            for key, value in pairs
+        )
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide cache of the MPC service configuration in mpc/config:
+
+    config.csv           - TRACK-IT presentation of each Results.csv row
+    radiation_units.csv  - LINAC serial number --> TRACK-IT RadiationUnit
+    energies.csv         - directory name flag --> energy Parameter
+
+Each directory is parsed once, into an MPCConfig with look-up indexes, and
+shared by every MPCPTWXml in the process.
+
+A config.csv row can stand for a numbered series of Results.csv rows, such as
+one per MLC leaf. {n=2-59} in its Name [Unit] (and P1-P4) marks the range, and
+{n} in any other column is replaced by the number:
+
+    CollimationGroup/MLCGroup/MLCLeavesA/MLCLeaf{n=2-59} [mm], ..., *MPC - BankA Leaf{n}, ...
+
+Rules are expanded on loading into the same rows as if each had been written
+out, so by_name finds them like any other row. The directory is only re-read when
+the modification time or size of one of its files changes, so configuration edits
+are picked up by a long running service without a restart.
+
+MPCConfig objects are treated as read-only after loading: a reload creates a
+new object, and callers copy rows before changing them. That makes them safe
+to share between threads. They are plain python objects that can be pickled
+to worker processes, and each process also keeps its own registry.
+
+Example usage:
+
+    config = MPCConfigRegistry.get("mpc/config")
+    config.radiation_unit("SN2795")         # 'LA8 VARIAN'
+    config.energy("BeamCheckTemplate10x")   # energies.csv row for 10x
+    config.by_name["IsoCenterGroup/IsoCenterSize [mm]"]
+    config.by_name["CollimationGroup/MLCGroup/MLCLeavesA/MLCLeaf12 [mm]"]
+
+"""
+
+import os
+import re
+from csv import DictReader as dr
+from threading import Lock
+
+FILES = ("config.csv", "radiation_units.csv", "energies.csv")
+RULE = re.compile(r"\{n=(\d+)-(\d+)\}") # {n=first-last} in a config.csv rule row
+
+
+class MPCConfig():
+    '''
+        Parsed, indexed and read-only contents of one config directory.
+
+        Attributes:
+            rows            - config.csv rows, rules expanded, tuple of dicts,
+                              not to be changed
+            by_name         - "Name [Unit]" --> config.csv row
+            radiation_units - SN --> RadiationUnit
+            energies        - energies.csv rows, tuple of dicts
+            energies_by_flag - lower case FLAG --> energies.csv row
+            stamp           - (mtime, size) of each file when loaded
+    '''
+    def __init__(self, config_dir):
+        self.config_dir = config_dir
+        self.stamp = MPCConfig.stat(config_dir)
+
+        with open(os.path.join(config_dir, "config.csv"), 'r', encoding='utf-8') as fcsv:
+            written = tuple(dr(fcsv, skipinitialspace=True))
+        self.rows = tuple(row for rule in written for row in MPCConfig.expand(rule))
+        by_name = {}
+        for row in self.rows:
+            by_name.setdefault(row["Name [Unit]"], row)
+        self.by_name = by_name
+
+        with open(os.path.join(config_dir, "radiation_units.csv"), 'r') as f:
+            self._units = tuple(
+                (row["SN"], row["RADIATION-UNIT"]) for row in dr(f, skipinitialspace=True))
+        self.radiation_units = dict(self._units)
+
+        with open(os.path.join(config_dir, "energies.csv"), newline='') as csvfile:
+            self.energies = tuple(dr(csvfile, skipinitialspace=True))
+        self.energies_by_flag = {}
+        for row in self.energies:
+            self.energies_by_flag.setdefault(row["FLAG"].lower(), row)
+
+        self._energy_cache = {}
+        self._unit_cache = {}
+
+    def radiation_unit(self, sn):
+        '''
+            RadiationUnit for a serial number such as "SN2795", the first
+            radiation_units.csv row whose SN appears in sn.
+            Raises StopIteration if there is none.
+        '''
+        unit = self._unit_cache.get(sn)
+        if unit is None:
+            unit = self.radiation_units.get(sn[2:] if sn.startswith("SN") else sn)
+            if unit is None:
+                unit = next(unit for row_sn, unit in self._units if row_sn in sn)
+            self._unit_cache[sn] = unit
+        return unit
+
+    def energy(self, template, flag = None):
+        '''
+            energies.csv row for an energy flag, e.g. "6x" from parse_mpc_dir.
+            Without a known flag, the first row whose FLAG appears in the
+            template name, e.g. "BeamCheckTemplate6xFFF".
+            Raises StopIteration if there is none.
+        '''
+        if flag is not None and flag.lower() in self.energies_by_flag:
+            return self.energies_by_flag[flag.lower()]
+        row = self._energy_cache.get(template)
+        if row is None:
+            row = next(row for row in self.energies if row["FLAG"] in template)
+            self._energy_cache[template] = row
+        return row
+
+    # -- static methods -- not dependent on object state
+    @staticmethod
+    def expand(row):
+        '''
+            The rows a config.csv row stands for: one per n for a rule row,
+            otherwise just the row.
+        '''
+        rule = RULE.search(row["Name [Unit]"] or "")
+        if rule is None:
+            return (row,)
+        first, last = int(rule.group(1)), int(rule.group(2))
+        return tuple(
+            {
+                key: RULE.sub(str(n), value).replace("{n}", str(n))
+                if isinstance(value, str) else value
+                for key, value in row.items()
+            }
+            for n in range(first, last + 1)
+        )
+
+    @staticmethod
+    def stat(config_dir):
+        stamp = []
+        for f_name in FILES:
+            st = os.stat(os.path.join(config_dir, f_name))
+            stamp.append((st.st_mtime_ns, st.st_size))
+        return tuple(stamp)
+
+
+class MPCConfigRegistry():
+    _configs = {} # absolute config_dir --> MPCConfig
+    _lock = Lock()
+
+    @classmethod
+    def get(cls, config_dir = "mpc/config"):
+        '''
+            MPCConfig for config_dir, loaded on first use and reloaded when
+            any of its files change.
+        '''
+        key = os.path.abspath(config_dir)
+        config = cls._configs.get(key)
+        if config is not None and config.stamp == MPCConfig.stat(key):
+            return config
+        with cls._lock:
+            config = cls._configs.get(key)
+            if config is None or config.stamp != MPCConfig.stat(key):
+                config = MPCConfig(key)
+                cls._configs[key] = config
+            return config
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._configs.clear()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+MPC results directory names, parsed without opening any files.
+
+The TrueBeam writes each MPC run to a directory named
+
+    NDS-WKS-SN2795-2022-11-16-07-46-30-0004-BeamCheckTemplate10xFFF
+            |      |                   |    |                 |  |
+            sn     acquisition date    seq  template      energy FFF
+
+parse_mpc_dir reads all of it with a single precompiled pattern, memoized per
+name. scan_mpc_dirs walks a data root with os.scandir and uses the names to
+skip directories by date and serial number before any file is read.
+
+Example usage:
+
+    info = parse_mpc_dir("NDS-WKS-SN2795-2022-11-16-07-46-30-0004-BeamCheckTemplate6xFFF")
+    info.sn, info.acquired, info.energy, info.fff   # '2795', datetime(...), '6x', True
+
+    for f_path, info in scan_mpc_dirs("./mpc/data", since = datetime(2022, 11, 16)):
+        ...
+
+"""
+
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+RESULTS = "Results.csv"
+
+MPC_DIR = re.compile(
+    r"^(?P<prefix>.*?)-?SN(?P<sn>[0-9A-Za-z]+)"
+    r"-(?P<Y>\d{4})-(?P<m>\d{2})-(?P<d>\d{2})-(?P<H>\d{2})-(?P<M>\d{2})-(?P<S>\d{2})"
+    r"-(?P<seq>\d+)"
+    r"-(?P<template>[^\d]*(?P<energy>\d+[xXeE])(?P<fff>FFF)?.*|.*)$"
+)
+
+MPCDirInfo = namedtuple(
+    "MPCDirInfo", ["name", "sn", "acquired", "seq", "template", "energy", "fff"])
+MPCDirInfo.__doc__ = '''
+    Fields of an MPC results directory name.
+        name     - the directory name
+        sn       - LINAC serial number, without the SN prefix
+        acquired - acquisition datetime
+        seq      - run number within the day, as written
+        template - check template, e.g. BeamCheckTemplate10xFFF
+        energy   - lower case energy flag, e.g. "10x" or "6e", None if absent
+        fff      - True for flattening filter free beams
+'''
+
+
+@lru_cache(maxsize = 65536)
+def parse_mpc_dir(name):
+    '''
+        MPCDirInfo for an MPC results directory name, None if name is not one.
+    '''
+    match = MPC_DIR.match(name)
+    if match is None:
+        return None
+    g = match.groupdict()
+    try:
+        acquired = datetime(int(g["Y"]), int(g["m"]), int(g["d"]),
+                            int(g["H"]), int(g["M"]), int(g["S"]))
+    except ValueError:
+        return None # not a real date
+    return MPCDirInfo(
+        name = name,
+        sn = g["sn"],
+        acquired = acquired,
+        seq = g["seq"],
+        template = g["template"],
+        energy = g["energy"].lower() if g["energy"] else None,
+        fff = g["fff"] is not None,
+    )
+
+
+def results_dir_info(f_path):
+    '''
+        MPCDirInfo of the MPC directory holding a Results.csv path, None if
+        that directory is not one.
+    '''
+    return parse_mpc_dir(os.path.basename(os.path.dirname(os.path.normpath(f_path))))
+
+
+def scan_mpc_dirs(root, since = None, until = None, sns = None):
+    '''
+        Yield (Results.csv path, MPCDirInfo) for each MPC directory under root.
+
+        MPC directories acquired before since (or at/after until), or for a
+        serial number not in sns, are skipped on their name alone. Other
+        directories are searched recursively. Results.csv paths are not
+        checked for existence, that is left to the first read.
+    '''
+    sns = set(sns) if sns is not None else None
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks = False):
+                    continue
+                info = parse_mpc_dir(entry.name)
+                if info is None:
+                    stack.append(entry.path) # not an MPC directory, look inside
+                elif ((since is None or info.acquired >= since)
+                      and (until is None or info.acquired < until)
+                      and (sns is None or info.sn in sns)):
+                    yield os.path.normpath(os.path.join(entry.path, RESULTS)), info
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+The MPCLeaseDir class lets several hosts run mpc_service against one shared
+MPC data drive without exporting the same results twice.
+
+Work is split into keys, e.g. one per LINAC ("linac-2795") or one per hash
+shard of the directory names ("shard-007"). A host only processes a key while
+it holds its lease, a file in the lease directory:
+
+    <lease_dir>/linac-2795.lease        owner token, created with O_EXCL
+    <lease_dir>/linac-2795.SN2795.watermark  acquisition date to start the next run of
+                                        a LINAC of the key from
+    <lease_dir>/done/<MPC directory>    "size mtime outcome" once it needs no more work
+
+    - claiming is atomic: os.open(O_CREAT | O_EXCL) succeeds for one host only
+    - a lease expires ttl seconds after its file was last touched. The holder
+      renews it (os.utime) every ttl / 3 seconds from a background thread
+    - an expired lease, left by a crashed host, is reclaimed by renaming it
+      out of the way (only one host can) before claiming it again
+    - done markers and watermarks are shared, so the next holder of a key
+      carries on where the last one stopped
+
+Files are marked done as soon as their export returns. If a host crashes,
+only the xml file it was exporting at the time can be sent again by the next
+holder, and TRACK-IT recognises the repeated Measurement guids.
+
+The lease directory should be on the shared drive, and ttl well above any
+clock difference between the hosts and the file server.
+
+Example usage:
+
+    leases = MPCLeaseDir("//share/mpc/.mpc_leases", ttl = 900)
+    with leases.hold("linac-2795") as lost:
+        if lost is not None:
+            since = leases.watermark("linac-2795", "2795")
+            ...                 # stop as soon as lost.is_set()
+            leases.mark_done(f_path, size, mtime, "exported")
+
+"""
+
+import os
+import re
+import socket
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Event, Thread
+from uuid import uuid4
+from modules.ptw_logging import get_logger
+
+_logger = get_logger("mpc_lease")
+
+
+class MPCLeaseDir():
+    def __init__(self, lease_dir, ttl = 900, owner = None):
+        '''
+            Params:
+                lease_dir   - directory shared by every host, created if missing
+                ttl         - seconds after which an unrenewed lease is expired
+                owner       - written in the lease files, default host:pid
+        '''
+        self.lease_dir = os.path.normpath(lease_dir)
+        self.ttl = ttl
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self._token = f"{self.owner} {uuid4().hex}" # unique to this object
+        os.makedirs(os.path.join(self.lease_dir, "done"), exist_ok = True)
+
+    # -- leases --
+    def acquire(self, key):
+        '''
+            Claim the lease for key. True if this object now holds it.
+        '''
+        path = self._path(key, ".lease")
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._reclaim(path):
+                    return False
+                continue
+            with os.fdopen(fd, "w", encoding = "utf-8") as f:
+                f.write(self._token)
+            return True
+        return False
+
+    def renew(self, key):
+        '''
+            Push the expiry of a held lease back by ttl.
+            False if the lease has been lost, e.g. reclaimed after a long stall.
+        '''
+        path = self._path(key, ".lease")
+        if not self.holds(key):
+            return False
+        try:
+            os.utime(path)
+        except OSError:
+            return False
+        return True
+
+    def release(self, key):
+        '''
+            Give up the lease for key, if this object holds it.
+        '''
+        if self.holds(key):
+            try:
+                os.remove(self._path(key, ".lease"))
+            except OSError:
+                pass
+
+    def holds(self, key):
+        try:
+            with open(self._path(key, ".lease"), encoding = "utf-8") as f:
+                return f.read() == self._token
+        except OSError:
+            return False
+
+    @contextmanager
+    def hold(self, key):
+        '''
+            Acquire the lease for key and keep renewing it until the block ends,
+            then release it. Yields None if the lease was not acquired, otherwise
+            an Event that is set if the lease is lost, e.g. reclaimed by another
+            host after a long stall. Work on key must stop once it is set.
+        '''
+        if not self.acquire(key):
+            yield None
+            return
+        stop = Event()
+        lost = Event()
+
+        def renew():
+            while not stop.wait(self.ttl / 3):
+                if not self.renew(key):
+                    _logger.error("%s: lease lost by %s", key, self.owner)
+                    lost.set()
+                    return
+
+        renewer = Thread(target = renew, daemon = True)
+        renewer.start()
+        _logger.info("%s: lease held by %s", key, self.owner)
+        try:
+            yield lost
+        finally:
+            stop.set()
+            renewer.join()
+            self.release(key)
+
+    def _reclaim(self, path):
+        '''
+            Move an expired lease out of the way. True if path is free to claim.
+        '''
+        try:
+            if time.time() - os.stat(path).st_mtime <= self.ttl:
+                return False # held
+        except FileNotFoundError:
+            return True
+        stale = f"{path}.{uuid4().hex}.stale"
+        try:
+            os.rename(path, stale) # only one host moves a given file
+        except FileNotFoundError:
+            return True # reclaimed by another host, race for the new lease
+        except OSError:
+            return False
+        try:
+            if time.time() - os.stat(stale).st_mtime <= self.ttl:
+                # renewed or replaced between the stat and the rename: put it back
+                try:
+                    os.link(stale, path)
+                except OSError:
+                    pass
+                return False
+            _logger.warning("%s: reclaimed expired lease", path)
+            return True
+        finally:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+    # -- shared progress --
+    def watermark(self, key, sn = None):
+        '''
+            Acquisition datetime the next holder of key should start the
+            LINAC sn from, or None. Falls back to the watermark of the whole
+            key, as kept by earlier versions.
+        '''
+        for ext in ([f".SN{sn}.watermark"] if sn is not None else []) + [".watermark"]:
+            try:
+                with open(self._path(key, ext), encoding = "utf-8") as f:
+                    return datetime.fromisoformat(f.read().strip())
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def set_watermark(self, key, value, sn = None):
+        ext = f".SN{sn}.watermark" if sn is not None else ".watermark"
+        self._write(self._path(key, ext), value.isoformat())
+
+    def is_done(self, f_path, size, mtime):
+        '''
+            True if any host has finished f_path, a Results.csv, at this size and mtime.
+        '''
+        try:
+            with open(self._done_path(f_path), encoding = "utf-8") as f:
+                done_size, done_mtime = f.read().split()[:2]
+        except (OSError, ValueError):
+            return False
+        return int(done_size) == size and int(done_mtime) == int(mtime)
+
+    def mark_done(self, f_path, size, mtime, outcome):
+        self._write(self._done_path(f_path), f"{size} {int(mtime)} {outcome}")
+
+    def _done_path(self, f_path):
+        return os.path.join(
+            self.lease_dir, "done", os.path.basename(os.path.dirname(os.path.normpath(f_path))))
+
+    def file_tag(self, key):
+        '''
+            owner_pid_key, safe to use in a file name. Unique to this process
+            and key, e.g. for the xml files written while the lease is held.
+        '''
+        return re.sub(r"[^\w.-]+", "-", f"{self.owner}_{os.getpid()}_{key}")
+
+    def _path(self, key, ext):
+        return os.path.join(self.lease_dir, key + ext)
+
+    def _write(self, path, text):
+        tmp = f"{path}.{uuid4().hex}.tmp"
+        with open(tmp, "w", encoding = "utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    # -- static methods -- not dependent on object state
+    @staticmethod
+    def shard(name, shards):
+        '''
+            Shard number of an MPC directory name, stable across hosts and runs.
+        '''
+        return zlib.crc32(name.encode("utf-8")) % shards
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming stages of the MPC service, chained as generators:
+
+    discover --> read --> unsent --> write_batches --> export_batches
+
+    discover        - (f_path, size, mtime, acquired) of each Results.csv to process
+    read            - parse, merge with the config and build the PTWTrackItXML record
+    unsent          - drop records already in TRACK-IT (PTWSentIndex)
+    write_batches   - validate and write one xml per batch_size records
+    export_batches  - run the exporter for each xml on a bounded queue
+
+Each stage pulls one item at a time from the one before. Only one batch of
+records is held while its xml is written, after which the records are dropped.
+The export queue holds at most queue_size written files, and the pipeline
+stalls when it is full. Peak memory therefore does not depend on how many files
+are waiting.
+
+RunStats keeps running counts for the summary, and records the outcome of
+each file in the MPCStateStore as it becomes known, in small transactions.
+
+Example usage:
+
+    stats = RunStats(state)
+    candidates = discover(state, since, stats, root = "./mpc/data/")
+    records = unsent(read(candidates, stats), PTWSentIndex(), stats)
+    written = write_batches(records, stats, batch_size = 50)
+    export_batches(written, PTWExportPool(), stats, sent, USERNAME, PASSWORD)
+    stats.flush()
+    print(stats.summary(since))
+
+"""
+
+import os
+from queue import Queue
+from threading import Lock, Thread
+from mpc.ptw_mpc import MPCPTWXml
+from mpc.mpc_dirs import scan_mpc_dirs
+from mpc.mpc_state import DONE
+from modules.ptw_batch import PTWTrackItBatchXML
+from modules.ptw_export import PTWExportPool
+from modules.ptw_logging import get_logger
+
+_logger = get_logger("mpc_pipeline")
+
+OUTCOMES = ("exported", "sent", "rejected", "failed", "error")
+# outcome of an in-run duplicate, given the outcome of its first copy
+DUPLICATE_OUTCOMES = {
+    "exported": "sent", "sent": "sent", "rejected": "rejected",
+    "failed": "failed", "error": "failed",
+}
+
+
+class RunStats():
+    def __init__(self, state = None, flush_every = 50, log_outcomes = False, on_done = None):
+        '''
+            Params:
+                state           - MPCStateStore to record outcomes in, optional
+                flush_every     - outcomes buffered per state transaction
+                log_outcomes    - log the outcome of each file
+                on_done         - called with (candidate, outcome) as soon as a
+                                  file is done (exported, sent or rejected)
+        '''
+        self.state = state
+        self.on_done = on_done
+        self.flush_every = max(1, int(flush_every))
+        self.log_outcomes = log_outcomes
+        self.n_seen = 0 # Results.csv files looked at
+        self.n_candidates = 0 # of which new, changed or to retry
+        self.exporter_calls = 0
+        self.latest = {} # SN --> latest acquisition seen
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+        self._rows = [] # outcomes not yet in state
+        self._outcomes = {} # f_path --> outcome, this run
+        self._waiting = {} # f_path --> duplicates waiting for its outcome
+        self._lock = Lock()
+
+    def seen(self, acquired, sn = None):
+        with self._lock:
+            self.n_seen += 1
+            if sn not in self.latest or acquired > self.latest[sn]:
+                self.latest[sn] = acquired
+
+    def candidate(self):
+        with self._lock:
+            self.n_candidates += 1
+
+    def done(self, candidate, outcome):
+        '''
+            Count the outcome of one candidate, (f_path, size, mtime, acquired),
+            and queue it for the state store.
+        '''
+        if self.log_outcomes:
+            _logger.info("%s: %s", candidate[0], outcome)
+        if self.on_done is not None and outcome in DONE:
+            self.on_done(candidate, outcome)
+        rows = None
+        with self._lock:
+            self.counts[outcome] += 1
+            self._rows.append((*candidate, outcome))
+            self._outcomes[candidate[0]] = outcome
+            duplicates = self._waiting.pop(candidate[0], ())
+            if len(self._rows) >= self.flush_every:
+                rows, self._rows = self._rows, []
+        if rows and self.state is not None:
+            self.state.record_many(rows)
+        for duplicate in duplicates:
+            self.done(duplicate, DUPLICATE_OUTCOMES[outcome])
+
+    def duplicate(self, first, candidate):
+        '''
+            candidate has the same content as first, seen earlier in the run.
+            It gets the outcome of first ("sent" once first is exported) as
+            soon as that is known, and none if first never gets one.
+        '''
+        with self._lock:
+            outcome = self._outcomes.get(first[0])
+            if outcome is None:
+                self._waiting.setdefault(first[0], []).append(candidate)
+                return
+        self.done(candidate, DUPLICATE_OUTCOMES[outcome])
+
+    def exported(self, result):
+        with self._lock:
+            self.exporter_calls += result.attempts
+
+    def flush(self):
+        '''
+            Write any buffered outcomes to the state store.
+        '''
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if rows and self.state is not None:
+            self.state.record_many(rows)
+
+    def summary(self, start):
+        '''
+            Summary message of a run.
+        '''
+        # -- TO DO --
+        # e-mail or log summary of success failures
+        return "\n".join(
+            [
+                f"Nightly MPC --> TRACK-IT log from {start}",
+                f"New MPC Files found: {self.n_candidates}",
+                f"Already processed, skipped: {self.n_seen - self.n_candidates}",
+                f"Already sent, skipped: {self.counts['sent']}",
+                f"Failed validation, not sent: {self.counts['rejected']}",
+                f"Exporter calls: {self.exporter_calls}",
+                f"Number of failures: {self.counts['failed'] + self.counts['error']}",
+                "\n"
+            ]
+        )
+
+
+def discover(state, since, stats, reprocess = False, root = "./mpc/data/",
+             until = None, sns = None, select = None, is_done = None, stop = None,
+             since_by_sn = None):
+    '''
+        Yield (f_path, size, mtime, acquired) for each Results.csv acquired
+        since (and before until) that is new, changed or previously failed.
+        since_by_sn (optional), SN --> datetime, starts some LINACs later
+        than since, e.g. at their own watermark.
+        Older directories and other LINACs are skipped on their name alone,
+        as are those for which select(MPCDirInfo), if given, is False.
+        is_done(f_path, size, mtime) defaults to state.is_done.
+        The scan ends early once stop (a threading.Event), if given, is set.
+    '''
+    is_done = is_done or state.is_done
+    for f_path, info in scan_mpc_dirs(root, since = since, until = until, sns = sns):
+        if stop is not None and stop.is_set():
+            return
+        if since_by_sn and info.acquired < since_by_sn.get(info.sn, since):
+            continue
+        if select is not None and not select(info):
+            continue
+        try:
+            st = os.stat(f_path)
+        except FileNotFoundError:
+            continue # no Results.csv (yet)
+        stats.seen(info.acquired, info.sn)
+        if reprocess or not is_done(f_path, st.st_size, st.st_mtime):
+            stats.candidate()
+            yield (f_path, st.st_size, st.st_mtime, info.acquired)
+
+
+def read(candidates, stats, config_dir = "mpc/config"):
+    '''
+        Yield (candidate, PTWTrackItXML) for each candidate that can be read.
+    '''
+    for candidate in candidates:
+        try:
+            record = MPCPTWXml(candidate[0], config_dir = config_dir).build_ptw_xml()
+        except Exception as e:
+            _logger.error("%s: could not be read: %s", candidate[0], e)
+            stats.done(candidate, "error")
+            continue
+        yield candidate, record
+
+
+def unsent(pairs, sent, stats, reprocess = False):
+    '''
+        Pass on the (candidate, record) pairs not yet delivered to TRACK-IT.
+        Repeats of the same content within a run are also dropped, and take
+        the outcome of the first copy once it is known (RunStats.duplicate).
+    '''
+    first = {} # content hash --> first candidate with it this run
+    for candidate, record in pairs:
+        content_hash = record.content_hash()
+        if not reprocess and content_hash in sent:
+            stats.done(candidate, "sent")
+            continue
+        if not reprocess and content_hash in first:
+            stats.duplicate(first[content_hash], candidate)
+            continue
+        first[content_hash] = candidate
+        yield candidate, record
+
+
+def write_batches(pairs, stats, batch_size = 50, f_prefix = "MPC", f_path = None):
+    '''
+        Validate records and write them to xml files of up to batch_size records.
+        Yields (f_out, cmd_parts, files) per xml file, where cmd_parts is
+        (import_client_path, track_it_ip) and files the (candidate, content hash)
+        of each record in it. Records are released once their file is written.
+    '''
+    n = 0
+    group = []
+    for pair in pairs:
+        group.append(pair)
+        if len(group) >= batch_size:
+            n += 1
+            yield from _write_batch(group, stats, n, f_prefix, f_path)
+            group = []
+    if group:
+        yield from _write_batch(group, stats, n + 1, f_prefix, f_path)
+
+
+def _write_batch(group, stats, n, f_prefix, f_path):
+    batch = PTWTrackItBatchXML(max_batch_size = len(group), f_prefix = f_prefix)
+    files = {}
+    for candidate, record in group:
+        if batch.add(record):
+            files[id(record)] = candidate
+        else:
+            stats.done(candidate, "rejected")
+    if not batch.records:
+        return
+    batch.print_xml(f_path, start = n)
+    first = batch.records[0]
+    cmd_parts = (first.import_client_path, first._track_it_ip)
+    for f_out, records in zip(batch._f_out, batch._f_records):
+        yield f_out, cmd_parts, [
+            (files.pop(id(record)), record.content_hash()) for record in records]
+    for candidate in files.values():
+        stats.done(candidate, "failed") # xml could not be written
+
+
+def export_batches(written, pool, stats, sent, user_name = None, password = None,
+                   queue_size = 8, stop = None):
+    '''
+        Export each written xml file on pool.max_workers threads. At most
+        queue_size files wait for an exporter; the stages before are paused
+        until there is room. Delivered records are added to sent.
+        Once stop (a threading.Event) is set no further export is started and
+        the stages before are no longer pulled. Exports already running are
+        finished; the files not exported are left without an outcome.
+    '''
+    jobs = Queue(maxsize = queue_size)
+
+    def stopped():
+        return stop is not None and stop.is_set()
+
+    def exporter():
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            if stopped():
+                continue # left for the next run
+            f_out, (import_client_path, track_it_ip), files = job
+            ok = False
+            try:
+                result = pool.export_one(*PTWExportPool.command(
+                    import_client_path, f_out, track_it_ip, user_name, password))
+                stats.exported(result)
+                ok = result.ok
+                if ok:
+                    sent.add(*(content_hash for candidate, content_hash in files))
+            except Exception as e: # keep the thread, and the queue, going
+                _logger.error("%s: export failed: %s", f_out, e)
+            for candidate, content_hash in files:
+                stats.done(candidate, "exported" if ok else "failed")
+
+    threads = [Thread(target = exporter, daemon = True) for _ in range(pool.max_workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for job in written:
+            if stopped():
+                break
+            jobs.put(job)
+    finally:
+        for thread in threads:
+            jobs.put(None)
+        for thread in threads:
+            thread.join()
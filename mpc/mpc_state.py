@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+The MPCStateStore class is a small SQLite record of the Results.csv files the
+MPC service has already processed, so that each run only handles new data.
+
+For each Results.csv it keeps the path, LINAC serial number, size, mtime,
+acquisition date and outcome of the last attempt:
+
+    exported    - delivered to TRACK-IT
+    sent        - already in TRACK-IT (PTWSentIndex), not sent again
+    rejected    - failed PTWTrackItValidator, not sent
+    failed      - the export tool failed, retried on the next run
+    error       - the file could not be read, retried on the next run
+
+A file is done when its outcome is exported, sent or rejected and its size and
+mtime have not changed since. A file that could not be read max_errors runs in
+a row is given up on, and treated as done, until its size or mtime changes.
+
+Each LINAC (serial number) has its own watermark, the acquisition date from
+which the next run should look for its MPC directories: the earliest file
+still to be retried, otherwise the latest acquisition seen. Directories
+acquired before it are not opened. LINACs copy their results to the share
+independently, so a single watermark would skip the directories of one LINAC
+that arrive after newer ones of another.
+
+Example usage:
+
+    state = MPCStateStore("./log/mpc_state.sqlite")
+    starts = state.starts(sns, datetime(2022, 11, 16)) # SN --> datetime
+    if not state.is_done(f_path, size, mtime):
+        ...
+        state.record(f_path, size, mtime, acquired, "exported")
+    state.set_watermarks(MPCStateStore.next_watermarks(starts, latest, state.earliest_pending()))
+
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+from threading import Lock
+from mpc.mpc_dirs import results_dir_info
+
+DONE = ("exported", "sent", "rejected")
+MAX_ERRORS = 3 # runs an unreadable file is retried on before it is given up
+
+
+class MPCStateStore():
+    def __init__(self, db_path = None, max_errors = MAX_ERRORS):
+        '''
+            Params:
+                db_path (optional)
+                    SQLite file, default ./log/mpc_state.sqlite
+                    Created with its tables on first use.
+                max_errors (optional)
+                    runs in a row a file can fail to be read before it is
+                    no longer retried, until it changes
+        '''
+        if db_path is None:
+            db_path = os.path.join(os.getcwd(), "log", "mpc_state.sqlite")
+        self.db_path = os.path.normpath(db_path)
+        self.max_errors = max_errors
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok = True)
+        self._lock = Lock()
+        self._db = sqlite3.connect(self.db_path, timeout = 30, check_same_thread = False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL") # readers do not block the service
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER, mtime REAL, acquired TEXT,"
+                " outcome TEXT, updated TEXT,"
+                " sn TEXT, attempts INTEGER DEFAULT 0)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._upgrade()
+
+    def _upgrade(self):
+        '''
+            Add the sn and attempts columns to a files table of an earlier version.
+        '''
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(files)")}
+        if "attempts" not in columns:
+            self._db.execute("ALTER TABLE files ADD COLUMN attempts INTEGER DEFAULT 0")
+        if "sn" not in columns:
+            self._db.execute("ALTER TABLE files ADD COLUMN sn TEXT")
+            paths = [row[0] for row in self._db.execute("SELECT path FROM files")]
+            self._db.executemany(
+                "UPDATE files SET sn = ? WHERE path = ?",
+                [(MPCStateStore.sn(f_path), f_path) for f_path in paths])
+
+    def is_done(self, f_path, size, mtime):
+        '''
+            True if f_path, with this size and mtime, needs no further
+            processing: done, or given up on after max_errors read errors.
+        '''
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime, outcome, attempts FROM files WHERE path = ?",
+                (os.path.normpath(f_path),)).fetchone()
+        return (row is not None and row[0] == size and row[1] == mtime
+                and (row[2] in DONE or (row[2] == "error" and row[3] >= self.max_errors)))
+
+    def record(self, f_path, size, mtime, acquired, outcome):
+        '''
+            Store the outcome of processing one file.
+        '''
+        self.record_many([(f_path, size, mtime, acquired, outcome)])
+
+    def record_many(self, rows):
+        '''
+            Store (f_path, size, mtime, acquired, outcome) for many files
+            in a single transaction. Read errors of an unchanged file are
+            counted, any other outcome or a change of the file resets the count.
+        '''
+        now = datetime.now().isoformat(timespec = "seconds")
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO files (path, size, mtime, acquired, outcome, updated, sn, attempts)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (path) DO UPDATE SET"
+                " size = excluded.size, mtime = excluded.mtime, acquired = excluded.acquired,"
+                " outcome = excluded.outcome, updated = excluded.updated, sn = excluded.sn,"
+                " attempts = CASE WHEN excluded.outcome = 'error' AND files.outcome = 'error'"
+                " AND files.size = excluded.size AND files.mtime = excluded.mtime"
+                " THEN files.attempts + 1 ELSE excluded.attempts END",
+                [
+                    (os.path.normpath(f_path), size, mtime,
+                     acquired.isoformat() if acquired else None, outcome, now,
+                     MPCStateStore.sn(f_path), int(outcome == "error"))
+                    for f_path, size, mtime, acquired, outcome in rows
+                ],
+            )
+
+    def outcomes(self):
+        '''
+            Count of files by outcome.
+        '''
+        with self._lock:
+            return dict(self._db.execute(
+                "SELECT outcome, COUNT(*) FROM files GROUP BY outcome").fetchall())
+
+    def earliest_pending(self):
+        '''
+            SN --> earliest acquisition datetime of a file of that LINAC
+            waiting to be retried (failed, or error and not given up on).
+        '''
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT sn, MIN(acquired) FROM files"
+                " WHERE outcome = 'failed' OR (outcome = 'error' AND attempts < ?)"
+                " GROUP BY sn", (self.max_errors,)).fetchall()
+        return {sn: datetime.fromisoformat(acquired) for sn, acquired in rows
+                if sn is not None and acquired}
+
+    def watermarks(self):
+        '''
+            SN --> acquisition datetime to start the next run of that LINAC from.
+        '''
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, value FROM meta WHERE key LIKE 'watermark:%'").fetchall()
+        return {key.split(":", 1)[1]: datetime.fromisoformat(value) for key, value in rows}
+
+    def set_watermarks(self, watermarks):
+        '''
+            Store the watermark of each LINAC in watermarks, SN --> datetime.
+            Other LINACs keep theirs.
+        '''
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [(f"watermark:{sn}", value.isoformat()) for sn, value in watermarks.items()])
+
+    def starts(self, sns, default):
+        '''
+            SN --> acquisition datetime to start from, for each LINAC in sns:
+            its watermark, else the single watermark of an earlier version,
+            else default.
+        '''
+        watermarks = self.watermarks()
+        fallback = self.watermark or default
+        return {sn: watermarks.get(sn, fallback) for sn in sns}
+
+    @property
+    def watermark(self):
+        '''
+            Single watermark shared by every LINAC, as kept by earlier versions.
+            Only used as the start of LINACs without a watermark of their own.
+        '''
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM meta WHERE key = 'watermark'").fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    @watermark.setter
+    def watermark(self, value):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('watermark', ?)",
+                (value.isoformat(),))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # -- static methods -- not dependent on object state
+    @staticmethod
+    def next_watermark(previous, acquired, pending):
+        '''
+            Watermark after a run.
+                previous - watermark the run started from (or None)
+                acquired - acquisition datetimes of every file looked at
+                pending  - acquisition datetimes of files to retry
+            The earliest pending file, so that it is listed again, otherwise
+            the latest acquisition seen.
+        '''
+        if pending:
+            return min(pending)
+        latest = max(acquired, default = None)
+        if previous is None:
+            return latest
+        return max(previous, latest) if latest else previous
+
+    @staticmethod
+    def next_watermarks(previous, latest, pending):
+        '''
+            next_watermark for each LINAC seen or with files to retry.
+                previous - SN --> watermark the run started from
+                latest   - SN --> latest acquisition seen
+                pending  - SN --> earliest acquisition of a file to retry
+        '''
+        return {
+            sn: MPCStateStore.next_watermark(
+                previous.get(sn), [latest[sn]] if sn in latest else [],
+                [pending[sn]] if sn in pending else [])
+            for sn in set(latest) | set(pending)
+        }
+
+    @staticmethod
+    def sn(f_path):
+        '''
+            LINAC serial number of a Results.csv path, None if its directory
+            is not an MPC results directory.
+        '''
+        info = results_dir_info(f_path)
+        return info.sn if info is not None else None
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+The MPCDirWatcher class polls an MPC data root for new results directories.
+
+Polling is cheap between arrivals:
+    - only folders whose mtime has changed are listed again, a new MPC
+      directory changes the mtime of the folder it is created in
+    - MPC directories are recognised by name (parse_mpc_dir), older than since
+      or for other LINACs they are ignored without being opened
+    - a full listing is repeated every rescan seconds as a safety net, e.g. for
+      network shares that do not update folder mtimes
+
+A new Results.csv is only handed out once it is debounced: its size and mtime
+have not changed between two polls and it was last written at least debounce
+seconds ago. Half-written files are never picked up.
+
+Example usage:
+
+    watcher = MPCDirWatcher("./mpc/data", since = watermark, debounce = 30)
+    while not stop.wait(10):
+        for f_path, info, size, mtime in watcher.poll():
+            ...
+
+"""
+
+import os
+import time
+from mpc.mpc_dirs import parse_mpc_dir, RESULTS
+
+
+class MPCDirWatcher():
+    def __init__(self, root, since = None, sns = None, debounce = 30, rescan = 600):
+        '''
+            Params:
+                root      - MPC data root
+                since     - ignore MPC directories acquired before this datetime
+                sns       - serial numbers to watch, default all
+                debounce  - seconds a Results.csv must be unchanged before it is ready
+                rescan    - seconds between full listings of every folder
+        '''
+        self.root = root
+        self.since = since
+        self.sns = set(sns) if sns is not None else None
+        self.debounce = debounce
+        self.rescan = rescan
+        self._folders = {} # folder path --> mtime_ns when last listed
+        self._children = {} # folder path --> sub-folders that are not MPC directories
+        self._pending = {} # Results.csv path --> (info, size, mtime) at the last poll
+        self._handed_out = set() # MPC directory paths already returned
+        self._last_rescan = 0.0
+
+    def poll(self):
+        '''
+            List of (Results.csv path, MPCDirInfo, size, mtime) that became ready
+            since the last poll, oldest acquisition first.
+        '''
+        now = time.time()
+        full = now - self._last_rescan >= self.rescan
+        if full:
+            self._last_rescan = now
+        self._scan(self.root, full)
+
+        ready = []
+        for f_path, (info, size, mtime) in list(self._pending.items()):
+            try:
+                st = os.stat(f_path)
+            except OSError:
+                continue # not written yet
+            if (st.st_size, st.st_mtime) == (size, mtime) and now - st.st_mtime >= self.debounce:
+                del self._pending[f_path]
+                self._handed_out.add(os.path.dirname(f_path))
+                ready.append((f_path, info, st.st_size, st.st_mtime))
+            else:
+                self._pending[f_path] = (info, st.st_size, st.st_mtime)
+        ready.sort(key = lambda item: item[1].acquired)
+        return ready
+
+    def _scan(self, folder, full):
+        '''
+            List folder if it is new or its mtime has changed (or full),
+            recursing into sub-folders that are not MPC directories.
+        '''
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            self._folders.pop(folder, None)
+            return
+        changed = full or self._folders.get(folder) != mtime
+        self._folders[folder] = mtime
+
+        if changed:
+            sub_folders = []
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks = False):
+                            self._found(entry, sub_folders)
+            except OSError:
+                return
+            self._children[folder] = sub_folders
+        for sub_folder in self._children.get(folder, ()):
+            self._scan(sub_folder, full)
+
+    def _found(self, entry, sub_folders):
+        info = parse_mpc_dir(entry.name)
+        if info is None:
+            sub_folders.append(entry.path)
+            return
+        mpc_dir = os.path.normpath(entry.path)
+        if mpc_dir in self._handed_out:
+            return
+        if self.since is not None and info.acquired < self.since:
+            return
+        if self.sns is not None and info.sn not in self.sns:
+            return
+        f_path = os.path.join(mpc_dir, RESULTS)
+        if f_path not in self._pending:
+            self._pending[f_path] = (info, None, None)
@@ -1,14 +1,28 @@
-from datetime import datetime, date, time, timezone
-from csv import DictReader as dr
+from datetime import datetime, timezone
+from csv import reader
+from mpc.config_registry import MPCConfigRegistry
+from mpc.mpc_dirs import parse_mpc_dir
 from os import path
 from modules.ptw_xml import PTWTrackItXML
-import subprocess
-from admin_mpc import USERNAME, PASSWORD
+from modules.ptw_template import PTWTrackItTemplate
+from modules.ptw_records import TrackItTable, TrackItRow
+from modules.ptw_logging import get_logger
+from modules.ptw_export import PTWExportPool
+from modules.ptw_validate import PTWTrackItValidator
+from logging import DEBUG, INFO, ERROR
+from mpc.admin_mpc import USERNAME, PASSWORD
+
+_logger = get_logger("ptw_mpc")
 
 class MPCPTWXml():
     '''
         Workhorse of the Varian MPC - PTW TRACK-IT service. 
 
+        Params: 
+            f_path: path to MPC Results.csv file. 
+            config_dir (optional): directory holding config.csv, 
+                radiation_units.csv and energies.csv, default mpc/config 
+
         Attributes: 
             f_name: str 
                 Path to MPC Results.csv file. 
@@ -20,55 +34,41 @@ class MPCPTWXml():
                 Datetime object.
                 MPC acquisition date. 
             params:
-                List of dicts. 
+                TrackItTable. 
                 Parameters passed to TRACK-IT per MPC record. 
             dtypes:
-                List of dicts.
+                TrackItTable.
                 DataTypes passed to TRACK-IT per MPC record. 
             meas: 
-                List of dicts.
+                TrackItTable.
                 Measurements passed to TRACK-IT per MPC record. 
 
         Methods: 
             check_acquisition_date_greater_than --> bool
             merge_config_and_data
+            build_ptw_xml --> PTWTrackItXML
             export_to_track_it -- > int (Process return code)
 
 
     '''
-    def __init__(self, f_path):
-        # parse the file name 
-        self.f_name = path.normpath(f_path).split(path.sep)[-2].split("-")
-        self.sn = self.f_name[2]
-        self.acqusition_date = datetime.combine(
-            date(
-            int(self.f_name[3]), int(self.f_name[4]), int(self.f_name[5])
-        ),
-        time(
-            int(self.f_name[6]), int(self.f_name[7]) , int(self.f_name[8])
-        )
-        )
+    def __init__(self, f_path, config_dir = "mpc/config"):
+        # parse the directory name 
+        dir_name = path.normpath(f_path).split(path.sep)[-2]
+        self.info = parse_mpc_dir(dir_name)
+        if self.info is None:
+            raise ValueError(f"Not an MPC results directory: {dir_name}")
+        self.f_name = dir_name.split("-")
+        self.sn = "SN" + self.info.sn
+        self.acqusition_date = self.info.acquired
 
         self.__version__ = "1.0"
 
-        # load the config file 
-        with open('mpc/config/config.csv', 'r', encoding='utf-8') as fcsv:
-            config = [row for row in dr(fcsv, skipinitialspace=True)]
-
-        # load the LINAC lookup file & find radiation_unit
-        with open("mpc/config/radiation_units.csv",'r') as f:
-            self.radiation_unit = next(
-                row for 
-                row in dr(f, skipinitialspace=True) 
-                if row["SN"] in self.sn
-            )['RADIATION-UNIT']
-
-        # open .config/energies.csv & set params 
-        with open("mpc/config/energies.csv", newline='') as csvfile:
-            energy = next(
-                row for row in dr(csvfile, skipinitialspace=True)
-                if row["FLAG"] in self.f_name[-1]
-            )
+        # config files are parsed once per process, see MPCConfigRegistry 
+        self.config = MPCConfigRegistry.get(config_dir)
+
+        # find radiation_unit & energy params 
+        self.radiation_unit = self.config.radiation_unit(self.sn)
+        energy = self.config.energy(self.info.template, flag = self.info.energy)
    
         self.params = [
             {
@@ -81,7 +81,7 @@ class MPCPTWXml():
                 "track-it":"*MPC - FFF",
                 "valuetype":"Boolean",
                 "unit":None,
-                "values": "FFF" in self.f_name[-1]
+                "values": self.info.fff
             },
             {
                 "track-it": "*MPC - Modality",
@@ -91,12 +91,12 @@ class MPCPTWXml():
             }
         ]
 
-        # read the Results.csv data 
-        with open(f_path, newline='') as csvfile:
-            self.data = [row for row in dr(csvfile, skipinitialspace=True)]
+        # read only the Results.csv values named in config.csv 
+        self.values, self.unmatched_data = MPCPTWXml.read_values(
+            f_path, self.config.by_name)
 
-        # merge the two list of dictionary objects 
-        self.merge_config_and_data(config)
+        # join the Results.csv values onto the shared config rows 
+        self.merge_config_and_data(self.config.rows)
 
     def check_acquisition_date_greater_than(self, dt: datetime) -> bool: 
         '''
@@ -109,20 +109,53 @@ class MPCPTWXml():
         '''
             Merge the values from the Results.csv file into the template in the 
             config file. 
+
+            Each config row is looked up in the values read by read_values, 
+            a single linear pass. The config rows are only read, every record 
+            gets new TrackItRow objects. 
+
+            Names found on one side only are kept for config drift detection: 
+                unmatched_config - config rows with no Results.csv value 
+                                   (AnalysisValues without a value are left out)
+                unmatched_data   - Results.csv rows with no config row, among 
+                                   those read before read_values stopped 
         '''
+        values = self.values
+        tables = {"dtypes": [], "meas": [], "params": []}
+        self.unmatched_config = []
+
         for row in config:
-            for line in self.data:
-                if line["Name [Unit]"]==row["Name [Unit]"]:
-                    row["values"] = line["Value"]
+            name = row["Name [Unit]"]
+            table = tables.get(row["type"])
+            if name in values:
+                new = TrackItRow.from_dict(row)
+                new.values = values[name]
+            else:
+                self.unmatched_config.append(name)
+                if table is None or row["type"] == "dtypes":
+                    continue
+                new = TrackItRow.from_dict(row) # blank, left out of the document 
+            if table is not None:
+                table.append(new)
+
+        if self.unmatched_data:
+            _logger.warning("%s: %d Results.csv rows not in config.csv: %s",
+                            "_".join(self.f_name), len(self.unmatched_data),
+                            ", ".join(self.unmatched_data))
+        if self.unmatched_config and _logger.isEnabledFor(DEBUG):
+            _logger.debug("%s: %d config.csv rows not in Results.csv: %s",
+                          "_".join(self.f_name), len(self.unmatched_config),
+                          ", ".join(self.unmatched_config))
 
-        self.dtypes = [row for row in config if row["type"]== "dtypes" and "values" in row]
-        self.meas = [row for row in config if row["type"]=="meas"]
-        for row in (row for row in config if row["type"]=="params"):
-            self.params.append(row)
+        self.dtypes = TrackItTable(tables["dtypes"], kind = "dtypes")
+        self.meas = TrackItTable(tables["meas"], kind = "meas")
+        self.params = TrackItTable(self.params + tables["params"], kind = "params")
 
-    def export_to_PTW(self):
+    def build_ptw_xml(self, record_log = False):
         '''
-            Override default export location in PTWTrackItXML class.
+            PTWTrackItXML record for this Results.csv file. 
+            Used directly by export_to_PTW, or added to a PTWTrackItBatchXML. 
+            record_log = True keeps the per-record .log file. 
         '''
         ptw_xml = PTWTrackItXML(
             comment = None, deviceID = "Varian MPC",
@@ -130,45 +163,94 @@ class MPCPTWXml():
             params = self.params, meas = self.meas, 
             dtypes = self.dtypes,
             measurement_date=self.acqusition_date,
+            record_log = record_log,
             information = {
                 "author": "MPC",
                 "source": " ".join(["MPCService v",self.__version__]) 
             }
         )
         ptw_xml._fname = "_".join(self.f_name)
-        ptw_xml.generate_xml() 
-        ptw_xml.print_xml()
-        password = PASSWORD
-        user_name = USERNAME
-        ptw_cmd = [
+        return ptw_xml
+
+    def export_to_PTW(self, record_log = False, pool = None):
+        '''
+            Override default export location in PTWTrackItXML class.
+            pool (optional) PTWExportPool, shared when exporting many records.
+            Returns the process return code, None if the export timed out or
+            the record failed validation.
+        '''
+        ptw_xml = self.build_ptw_xml(record_log = record_log)
+        issues = PTWTrackItValidator.validate(ptw_xml)
+        if issues:
+            ptw_xml._log(ERROR, "Not exported, %d problems: %s", len(issues),
+                         "; ".join(str(issue) for issue in issues))
+            ptw_xml.build_xml_log()
+            return None
+        # every MPC record shares a handful of layouts, only the values change 
+        PTWTrackItTemplate.for_record(ptw_xml).print_xml(ptw_xml)
+        f_out, ptw_cmd = PTWExportPool.command(
             ptw_xml.import_client_path,
-            "-i",
             ptw_xml._f_out,
-            "-o",
             ptw_xml._track_it_ip,
-            "-m",
-            "1",
-            "-u",
-            user_name,
-            "-p",
-            password,
-            ]
-
-        pd = subprocess.run(
-            args=ptw_cmd, 
-            shell = True, 
-            check = True,
-            timeout=60,
-            text=True
+            user_name = USERNAME,
+            password = PASSWORD,
             )
 
-        ptw_xml._xml_build_log.append(f"RadiationUnit: {self.radiation_unit}")
-        ptw_xml._xml_build_log.append(" ".join([item for item in ptw_cmd]))
-        ptw_xml._xml_build_log.append(f"TRACK-IT Export Process return code: {pd.returncode}") 
+        # failures and timeouts come back as a result, nothing is raised 
+        result = (pool or PTWExportPool(max_workers = 1)).export_one(f_out, ptw_cmd)
+
+        ptw_xml._log(INFO, "RadiationUnit: %s", self.radiation_unit)
+        ptw_xml._log(INFO, "%s", " ".join([str(item) for item in ptw_cmd[:-6]]))
+        ptw_xml._log(INFO if result.ok else ERROR,
+                     "TRACK-IT Export Process return code: %s (%d attempts) %s",
+                     result.returncode, result.attempts, result.error) 
 
         ptw_xml.build_xml_log() 
 
-        return pd.returncode
+        return result.returncode
+
+    # -- static methods -- not dependent on object state 
+    @staticmethod
+    def read_values(f_path, names):
+        '''
+            Read the Value of each Name [Unit] in names from a Results.csv file. 
+            Returns (values, unmatched): Name [Unit] --> Value, and the other 
+            names read. 
+
+            Only the Name [Unit] and Value columns are taken from each line, 
+            with a plain split, no dict per row. Reading stops once every name 
+            has been found, so per-leaf rows after the last wanted row are 
+            never read. Lines with quotes go through the csv module. 
+            Fields are stripped of leading spaces, as DictReader with 
+            skipinitialspace. 
+        '''
+        values = {}
+        unmatched = {}
+        remaining = len(names)
+        with open(f_path, newline='') as csvfile:
+            header = [field.strip() for field in next(reader([csvfile.readline()]), [])]
+            try:
+                i_name, i_value = header.index("Name [Unit]"), header.index("Value")
+            except ValueError:
+                raise ValueError(f"{f_path}: no Name [Unit] and Value columns")
+            width = max(i_name, i_value) + 1
+
+            for line in csvfile:
+                if '"' in line:
+                    fields = next(reader([line], skipinitialspace = True), [])
+                else:
+                    fields = line.rstrip("\r\n").split(",")
+                if len(fields) < width:
+                    continue # blank or short line 
+                name = fields[i_name].lstrip(" ")
+                if name not in names:
+                    unmatched[name] = None
+                elif name not in values:
+                    values[name] = fields[i_value].lstrip(" ")
+                    remaining -= 1
+                    if not remaining:
+                        break
+        return values, list(unmatched)
 
 
             
@@ -1,65 +1,472 @@
 '''
-@author:    Liam Stubbington 
+@author:    Liam Stubbington
             RT Physicist, Cambridge University Hospitals NHS Foundation Trust
-            
+
 version: 1.0
+
+Usage:
+    python mpc_service.py                       new MPC results since the last run
+    python mpc_service.py --since 2022-11-16    backfill from a date
+    python mpc_service.py --reprocess           send again, even if already processed
+    python mpc_service.py --watch               keep running, export results as they arrive
+    python mpc_service.py --backfill --since 2020-01-01 --workers 8
+                                                historical results on a process pool
+    python mpc_service.py --shard-by linac      one of several hosts on a shared data drive
 '''
 
 
 
 import os
-from glob import glob
+import random
+import argparse
+import signal
+from threading import Event
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from progress.bar import Bar
 from mpc.ptw_mpc import MPCPTWXml
+from mpc.admin_mpc import USERNAME, PASSWORD
+from mpc.mpc_state import MPCStateStore
+from mpc.mpc_pipeline import RunStats, discover, read, unsent, write_batches, export_batches
+from mpc.mpc_pipeline import DUPLICATE_OUTCOMES
+from mpc.mpc_watch import MPCDirWatcher
+from mpc.mpc_lease import MPCLeaseDir
+from mpc.config_registry import MPCConfigRegistry
+from modules.ptw_batch import PTWTrackItBatchXML
+from modules.ptw_logging import configure_run_log, get_logger
+from modules.ptw_dedup import PTWSentIndex
+from modules.ptw_export import PTWExportPool
 from datetime import datetime
 import time
 
 PATH = "./mpc/data/"
-EXT = "*.csv"
-
-
-
-all_csv_files = [f
-                 for path, subdir, files in os.walk(PATH)
-                 for f in glob(os.path.normpath(
-                     os.path.join(path, EXT)))
-                     ]
+BATCH_SIZE = 50 # MPC records per TrackitExporter.exe call
+LOG_PATH = "./log/mpc_service.log" # one rotating log shared by every record in a run
+SENT_INDEX_PATH = "./log/sent_index.txt" # content hashes of records already in TRACK-IT
+STATE_PATH = "./log/mpc_state.sqlite" # processed files and watermark
+EXPORT_WORKERS = 4 # concurrent TrackitExporter.exe processes
+EXPORT_TIMEOUT = 120 # seconds per exporter call
+EXPORT_RETRIES = 2 # extra attempts, with exponential backoff
+EXPORT_QUEUE = 8 # written xml files waiting for an exporter, bounds memory
+SHARDS = 16 # --shard-by dir: number of lease keys
+LEASE_TTL = 900 # seconds before a crashed host's lease can be reclaimed
 
+# first run only, later runs start from the watermark in STATE_PATH
 # datetime(year, month, day, hour, minute, second, microsecond)
-dt = datetime(
+DEFAULT_SINCE = datetime(
     year=2022,
     month=11,
     day=16,
 )
 
-# -- TO DO --
-# Identify MPC files with a datestamp >=midnight today 
-nw = datetime.now()
-midnight_today = datetime(
-    year=nw.year, 
-    month=nw.month,
-    day=nw.day
-)
+_logger = get_logger("mpc_service")
+
+
+def build_batch(candidates, reprocess = False, sent = None, f_prefix = "MPC"):
+    '''
+        Read candidates, (f_path, size, mtime, acquired), into PTWTrackItXML
+        records, drop those already sent and collect the rest in a
+        PTWTrackItBatchXML, which validates them.
+        Returns (batch, outcomes, files, duplicates): f_path --> outcome so
+        far, id(record) --> candidate and, for repeats of the same content
+        within candidates, f_path --> f_path of the first copy. A repeat
+        takes the outcome of its first copy once that is known.
+    '''
+    outcomes = {} # f_path --> outcome
+    files = {} # id(record) --> candidate
+    new_records = []
+    for candidate in candidates:
+        try:
+            record = MPCPTWXml(candidate[0]).build_ptw_xml()
+        except Exception as e:
+            _logger.error("%s: could not be read: %s", candidate[0], e)
+            outcomes[candidate[0]] = "error"
+            continue
+        files[id(record)] = candidate
+        new_records.append(record)
+
+    # skip anything already delivered on a previous run
+    sent = sent or PTWSentIndex(SENT_INDEX_PATH)
+    files_to_process = new_records if reprocess else sent.filter_new(new_records)
+    to_process = {id(record) for record in files_to_process}
+    first = {record.content_hash(): files[id(record)][0] for record in files_to_process}
+    duplicates = {} # f_path --> f_path of the first copy
+    for record in new_records:
+        if id(record) not in to_process:
+            content_hash = record.content_hash()
+            if content_hash in first:
+                duplicates[files[id(record)][0]] = first[content_hash]
+            else:
+                outcomes[files[id(record)][0]] = "sent"
+
+    # one xml and one exporter call per BATCH_SIZE records
+    batch = PTWTrackItBatchXML(
+        records = files_to_process,
+        max_batch_size = BATCH_SIZE,
+        f_prefix = f_prefix,
+    )
+    for record, issues in batch.rejected:
+        outcomes[files[id(record)][0]] = "rejected"
+    return batch, outcomes, files, duplicates
+
 
-files_to_process = [
-    MPCPTWXml(mpc_csv).export_to_PTW() 
-    for mpc_csv in all_csv_files
-    if MPCPTWXml(mpc_csv).check_acquisition_date_greater_than(dt)
-]
-
-# -- TO DO -- 
-# e-mail or log summary of success failures 
-fails = [f for f in files_to_process if f != 0]
-message = "\n".join(
-    [
-        f"Nightly MPC --> TRACK-IT log for {dt}",
-        f"New MPC Files found: {len(files_to_process)}",
-        f"Number of failures: {len(fails)}",
-        "\n"
+def export_pool():
+    return PTWExportPool(
+        max_workers = EXPORT_WORKERS,
+        timeout = EXPORT_TIMEOUT,
+        retries = EXPORT_RETRIES,
+    )
+
+
+def export_stream(candidates, stats, reprocess = False, pool = None, f_prefix = "MPC",
+                  stop = None):
+    '''
+        Read, validate and export candidates, an iterable of
+        (f_path, size, mtime, acquired), through the mpc_pipeline stages.
+        Outcomes are counted, and recorded in the state store, by stats.
+        pool (optional) PTWExportPool, default export_pool()
+        f_prefix (optional) start of the xml file names
+        stop (optional) threading.Event, no new export is started once it is set
+    '''
+    sent = PTWSentIndex(SENT_INDEX_PATH)
+    records = unsent(read(candidates, stats), sent, stats, reprocess = reprocess)
+    written = write_batches(records, stats, batch_size = BATCH_SIZE, f_prefix = f_prefix)
+    export_batches(written, pool or export_pool(), stats, sent, USERNAME, PASSWORD,
+                   queue_size = EXPORT_QUEUE, stop = stop)
+    stats.flush()
+
+
+def run(since = None, reprocess = False, root = PATH, stop = None):
+    '''
+        Export the MPC results acquired since the watermark of each LINAC
+        (or since), record the outcome of each file and move the watermarks on.
+        Once stop (a threading.Event), if given, is set no new export is
+        started and the watermarks are left where they were.
+        Returns the summary message.
+    '''
+    state = MPCStateStore(STATE_PATH)
+    sns = MPCConfigRegistry.get().radiation_units
+    starts = None if since else state.starts(sns, DEFAULT_SINCE)
+    start = since or min(starts.values(), default = DEFAULT_SINCE)
+
+    stats = RunStats(state)
+    export_stream(
+        discover(state, start, stats, reprocess = reprocess, root = root, sns = sns,
+                 stop = stop, since_by_sn = starts),
+        stats, reprocess = reprocess, stop = stop)
+
+    # each watermark stays at the earliest file of its LINAC still to retry,
+    # files skipped after a stop have no outcome to hold it back
+    if since is None and not (stop is not None and stop.is_set()):
+        state.set_watermarks(MPCStateStore.next_watermarks(
+            starts, stats.latest, state.earliest_pending()))
+    state.close()
+
+    message = stats.summary(start)
+    _logger.info("%s", message)
+    return message
+
+
+_worker_sent = None # PTWSentIndex of a backfill worker process
+
+def _build_chunk(index, chunk, reprocess = False):
+    '''
+        Backfill worker, run in a separate process: read, merge, validate and
+        write the xml for one chunk of candidates. Returns plain data only:
+            written  - (xml path, Results.csv paths, content hashes) per xml file
+            outcomes - f_path --> outcome for files that will not be exported
+            duplicates - f_path --> first copy, for repeats within the chunk
+            client, ip - export tool and TRACK-IT server of the records
+    '''
+    global _worker_sent
+    if _worker_sent is None:
+        _worker_sent = PTWSentIndex(SENT_INDEX_PATH) # read once per worker process
+    batch, outcomes, files, duplicates = build_batch(
+        chunk, reprocess = reprocess, sent = _worker_sent, f_prefix = f"MPC_backfill_{index:05d}")
+    if batch.records:
+        batch.print_xml()
+    written = [
+        (f_out,
+         [files[id(record)][0] for record in records],
+         [record.content_hash() for record in records])
+        for f_out, records in zip(batch._f_out, batch._f_records)
     ]
-)
+    in_files = {f_path for f_out, f_paths, hashes in written for f_path in f_paths}
+    for record in batch.records:
+        if files[id(record)][0] not in in_files:
+            outcomes[files[id(record)][0]] = "failed" # xml could not be written
+    first = batch.records[0] if batch.records else None
+    return {
+        "written": written,
+        "outcomes": outcomes,
+        "duplicates": duplicates,
+        "client": first.import_client_path if first else None,
+        "ip": first._track_it_ip if first else None,
+    }
+
+
+def backfill(since, until = None, workers = None, chunk_size = BATCH_SIZE,
+             reprocess = False, root = PATH):
+    '''
+        Export historical MPC results acquired between since and until, e.g.
+        when a new LINAC or energy is onboarded.
+
+        Files are split into chunks of chunk_size, in acquisition order. Reading,
+        merging, validation and xml generation run on a pool of workers
+        processes (default one per CPU), at most two chunks per worker ahead
+        of the export. The xml files are exported by a single stage, one chunk
+        at a time and in order, and the outcome of each file is recorded.
+        The watermark is not moved.
+        Returns the summary message.
+    '''
+    state = MPCStateStore(STATE_PATH)
+    stats = RunStats(state)
+    candidates = sorted(
+        discover(state, since, stats, reprocess = reprocess, root = root, until = until,
+                 sns = MPCConfigRegistry.get().radiation_units),
+        key = lambda candidate: candidate[3])
+    chunks = [candidates[i:i + chunk_size] for i in range(0, len(candidates), chunk_size)]
+
+    sent = PTWSentIndex(SENT_INDEX_PATH)
+    pool = export_pool()
+    bar = Bar("Backfill", max = max(1, len(chunks)),
+              suffix = "%(index)d/%(max)d chunks - %(eta_td)s remaining")
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers = workers) as ex:
+        in_flight = deque()
+        to_submit = iter(enumerate(chunks))
+        for index, chunk in islice(to_submit, 2 * workers):
+            in_flight.append((chunk, ex.submit(_build_chunk, index, chunk, reprocess)))
+
+        while in_flight:
+            chunk, future = in_flight.popleft()
+            for index, next_chunk in islice(to_submit, 1):
+                in_flight.append((next_chunk, ex.submit(_build_chunk, index, next_chunk, reprocess)))
+            try:
+                built = future.result()
+            except Exception as e:
+                _logger.error("Backfill chunk failed: %s", e)
+                built = {"written": [], "outcomes": {c[0]: "error" for c in chunk},
+                         "duplicates": {}}
+
+            # ordered export stage
+            chunk_outcomes = built["outcomes"]
+            jobs = [
+                PTWExportPool.command(built["client"], f_out, built["ip"], USERNAME, PASSWORD)
+                for f_out, f_paths, hashes in built["written"]
+            ]
+            for (f_out, f_paths, hashes), result in zip(built["written"], pool.export(jobs)):
+                stats.exported(result)
+                if result.ok:
+                    sent.add(*hashes)
+                for f_path in f_paths:
+                    chunk_outcomes[f_path] = "exported" if result.ok else "failed"
+            # only "sent" once the first copy has been exported
+            for f_path, first in built["duplicates"].items():
+                chunk_outcomes[f_path] = DUPLICATE_OUTCOMES[chunk_outcomes.get(first, "failed")]
+            for candidate in chunk:
+                stats.done(candidate, chunk_outcomes.get(candidate[0], "failed"))
+            bar.next()
+    bar.finish()
+    stats.flush()
+    state.close()
+
+    message = stats.summary(since)
+    _logger.info("%s", message)
+    return message
+
+
+def shard_keys(by = "linac", shards = SHARDS):
+    '''
+        Lease key --> (sns, select) for each unit of sharded work:
+            linac - one key per LINAC in radiation_units.csv
+            dir   - shards keys, by hash of the MPC directory name. The
+                    results of a LINAC are spread over several keys, and so
+                    hosts, and are not exported in acquisition order.
+    '''
+    if by == "linac":
+        return {f"linac-{sn}": ({sn}, None) for sn in MPCConfigRegistry.get().radiation_units}
+    sns = MPCConfigRegistry.get().radiation_units
+    return {
+        f"shard-{shard:03d}": (sns, lambda info, shard = shard:
+                               MPCLeaseDir.shard(info.name, shards) == shard)
+        for shard in range(shards)
+    }
+
+
+def run_sharded(by = "linac", shards = SHARDS, lease_dir = None, ttl = LEASE_TTL,
+                since = None, reprocess = False, root = PATH):
+    '''
+        Run as one of several hosts sharing the data root. Each key of
+        shard_keys is processed only while its lease is held (MPCLeaseDir),
+        keys held by other hosts are skipped. Files finished by any host are
+        marked done in lease_dir, default <root>/.mpc_leases, and each key
+        has a watermark per LINAC there.
+
+        Files of a key are exported one at a time in acquisition order, so
+        by = "linac" keeps the export order of each LINAC. by = "dir" spreads
+        a LINAC over several hosts and does not.
+        If the lease of a key is lost, no further export of the key is started.
+        Returns the summary message.
+    '''
+    leases = MPCLeaseDir(lease_dir or os.path.join(root, ".mpc_leases"), ttl = ttl)
+    state = MPCStateStore(STATE_PATH)
+    # marked straight away, a host that takes over after a crash skips them
+    stats = RunStats(state, on_done = lambda candidate, outcome:
+                     leases.mark_done(*candidate[:3], outcome))
+    pool = PTWExportPool(max_workers = 1, timeout = EXPORT_TIMEOUT, retries = EXPORT_RETRIES)
+    start = since or DEFAULT_SINCE
+
+    def is_done(f_path, size, mtime): # by this host, or any other
+        return state.is_done(f_path, size, mtime) or leases.is_done(f_path, size, mtime)
+
+    keys = list(shard_keys(by, shards).items())
+    random.shuffle(keys) # hosts starting together try different keys first
+    for key, (sns, select) in keys:
+        with leases.hold(key) as lost:
+            if lost is None:
+                continue
+            # a dir key covers several LINACs, each is started from its own watermark
+            starts = {sn: since or leases.watermark(key, sn) or start for sn in sns}
+            candidates = sorted(
+                discover(state, min(starts.values(), default = start), stats,
+                         reprocess = reprocess, root = root, sns = sns, select = select,
+                         is_done = is_done, since_by_sn = starts),
+                key = lambda candidate: candidate[3])
+            # hosts may share the xml folder: names unique to this writer and key
+            export_stream(candidates, stats, reprocess = reprocess, pool = pool,
+                          f_prefix = f"MPC_{leases.file_tag(key)}", stop = lost)
+            if lost.is_set():
+                _logger.error("%s: lease lost, stopped, left to its new holder", key)
+                continue
+
+            if since is None:
+                # files given up on (see MPCStateStore max_errors) do not hold it back
+                latest, pending = {}, {}
+                for candidate in candidates:
+                    sn = MPCStateStore.sn(candidate[0])
+                    latest[sn] = max(latest.get(sn, candidate[3]), candidate[3])
+                    if not is_done(*candidate[:3]):
+                        pending[sn] = min(pending.get(sn, candidate[3]), candidate[3])
+                for sn, watermark in MPCStateStore.next_watermarks(starts, latest, pending).items():
+                    leases.set_watermark(key, watermark, sn)
+    state.close()
+
+    message = stats.summary(start)
+    _logger.info("%s", message)
+    return message
+
+
+def watch(root = PATH, interval = 10, debounce = 30, retry = 600, stop = None):
+    '''
+        Long running mode: export each new Results.csv within seconds of it
+        being written, until stop (a threading.Event) is set.
+
+        Starts with a normal run from the watermark, so a restart picks up
+        anything that arrived while the service was down. The data root is
+        then polled every interval seconds (MPCDirWatcher), files are only
+        taken once unchanged for debounce seconds, and a full run from the
+        watermark every retry seconds retries failed exports.
+        The exports already started when stop is set are finished first.
+    '''
+    stop = stop or Event()
+    run(root = root, stop = stop)
+    last_run = time.monotonic()
+
+    state = MPCStateStore(STATE_PATH)
+    sns = MPCConfigRegistry.get().radiation_units
+    # from the earliest watermark, is_done skips the files already processed
+    watcher = MPCDirWatcher(
+        root,
+        since = min(state.starts(sns, DEFAULT_SINCE).values(), default = DEFAULT_SINCE),
+        sns = sns,
+        debounce = debounce,
+        rescan = retry,
+    )
+    _logger.info("Watching %s every %s s", root, interval)
+    while not stop.wait(interval):
+        if time.monotonic() - last_run >= retry:
+            run(root = root, stop = stop)
+            last_run = time.monotonic()
+
+        ready = [
+            (f_path, info, size, mtime)
+            for f_path, info, size, mtime in watcher.poll()
+            if not state.is_done(f_path, size, mtime)
+        ]
+        if not ready:
+            continue
+        export_stream([(f_path, size, mtime, info.acquired) for f_path, info, size, mtime in ready],
+                      RunStats(state, log_outcomes = True), stop = stop)
+        if stop.is_set():
+            break
+        latest = {}
+        for f_path, info, size, mtime in ready:
+            latest[info.sn] = max(latest.get(info.sn, info.acquired), info.acquired)
+        state.set_watermarks(MPCStateStore.next_watermarks(
+            state.starts(sns, DEFAULT_SINCE), latest, state.earliest_pending()))
+    state.close()
+    _logger.info("Stopped watching %s", root)
 
-print(message)
-time.sleep(5)
-    
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Varian MPC --> PTW TRACK-IT service")
+    parser.add_argument(
+        "--since", type = datetime.fromisoformat, default = None,
+        help = "process MPC results acquired from this date, e.g. 2022-11-16, "
+               "instead of the watermark left by the last run")
+    parser.add_argument(
+        "--reprocess", action = "store_true",
+        help = "process and send files again even if they were already processed or sent")
+    parser.add_argument("--data", default = PATH, help = "MPC data root")
+    parser.add_argument(
+        "--watch", action = "store_true",
+        help = "keep running, exporting new results as they arrive (Ctrl+C to stop)")
+    parser.add_argument("--interval", type = float, default = 10,
+                        help = "--watch: seconds between polls of the data root")
+    parser.add_argument("--debounce", type = float, default = 30,
+                        help = "--watch: seconds a Results.csv must be unchanged before export")
+    parser.add_argument(
+        "--backfill", action = "store_true",
+        help = "export historical results from --since (to --until) on a pool of processes")
+    parser.add_argument("--until", type = datetime.fromisoformat, default = None,
+                        help = "--backfill: results acquired before this date")
+    parser.add_argument("--workers", type = int, default = None,
+                        help = "--backfill: worker processes, default one per CPU")
+    parser.add_argument("--chunk-size", type = int, default = BATCH_SIZE,
+                        help = "--backfill: Results.csv files per worker task")
+    parser.add_argument(
+        "--shard-by", choices = ("linac", "dir"), default = None,
+        help = "run as one of several hosts sharing the data root, claiming work "
+               "per LINAC or per hash of the directory name with lease files. "
+               "Only linac keeps the export order of each LINAC")
+    parser.add_argument("--shards", type = int, default = SHARDS,
+                        help = "--shard-by dir: number of shards")
+    parser.add_argument("--lease-dir", default = None,
+                        help = "--shard-by: shared lease directory, default <data>/.mpc_leases")
+    parser.add_argument("--lease-ttl", type = float, default = LEASE_TTL,
+                        help = "--shard-by: seconds before an unrenewed lease expires")
+    args = parser.parse_args()
+    if args.backfill and args.since is None:
+        parser.error("--backfill needs --since")
 
+    configure_run_log(LOG_PATH)
+    if args.shard_by:
+        print(run_sharded(by = args.shard_by, shards = args.shards, lease_dir = args.lease_dir,
+                          ttl = args.lease_ttl, since = args.since, reprocess = args.reprocess,
+                          root = args.data))
+    elif args.backfill:
+        print(backfill(since = args.since, until = args.until, workers = args.workers,
+                       chunk_size = args.chunk_size, reprocess = args.reprocess,
+                       root = args.data))
+    elif args.watch:
+        stop = Event()
+        # finish the current export, then exit
+        for sig in ("SIGINT", "SIGTERM", "SIGBREAK"):
+            if hasattr(signal, sig):
+                signal.signal(getattr(signal, sig), lambda *_: stop.set())
+        watch(root = args.data, interval = args.interval, debounce = args.debounce, stop = stop)
+    else:
+        print(run(since = args.since, reprocess = args.reprocess, root = args.data))
+        time.sleep(5)
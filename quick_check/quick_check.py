@@ -7,9 +7,17 @@
 '''
 
 
-from os import path
+from os import path, remove, replace, stat
+from mmap import mmap, ACCESS_READ
+from tempfile import mkstemp
+from shutil import copymode
+import json
+from bisect import bisect_left, insort
 import xmltodict as xmld
 from csv import DictReader as dr
+from xml.parsers import expat
+from xml.sax.saxutils import XMLGenerator
+from xml.sax.xmlreader import AttributesImpl
 
 class PTWQuickCheckDBTool():
     '''
@@ -19,19 +27,50 @@ class PTWQuickCheckDBTool():
         Attributes: 
             qcw_in 
                 xmltodict instance of input qcw database file 
+                None in streaming mode 
+            f_in 
+                Path to the input qcw database file 
             config
                 List of dicts.
                 Used to change AnalyzeParams in qcw file 
+            rule_counts 
+                Elements matched by each rule of the last apply_rules, or of 
+                the rules written by the last streaming write_new_qcw_file. 
+            n_changed 
+                Elements matched by at least one of those rules. 
+            index 
+                QCWIndex of the input file, or None. 
         Methods: 
             change_all_analysis_params
                 Change the Min, Max, Target and Norm for all 
                 elements matching an AdminValue condition. 
+            apply_rules
+                Apply a set of (AdminValue condition --> config table) rules 
+                in one pass, with a count per rule or a dry run. 
             write_new_qcw_file
                 Write the modified database to file. 
+            find 
+                Positions of the TrendData elements matching AdminValues. 
+            get_records 
+                TrendData elements at the given positions. 
+            write_records 
+                Write changed TrendData elements back to the database file. 
+
+        Streaming mode (stream = True) never holds the whole database. 
+        Conditions and rules are kept until write_new_qcw_file, which reads the 
+        input with expat and handles one TrendData element at a time: 
+        parsed with xmltodict, changed, written to the output and 
+        dropped. Memory stays flat whatever the size of the database, 
+        and the output matches the non-streaming one. 
+
+        With an index (index = True) elements are found through a QCWIndex 
+        of their AdminValues, saved next to the database, instead of 
+        checking every element. 
 
     '''
 
-    def __init__(self, qcw_in: str, config_csv: str = "./config.csv"):
+    def __init__(self, qcw_in: str, config_csv: str = "./config.csv", stream: bool = False, 
+        index: bool = False):
         '''
             Params:
                 qcw_in 
@@ -39,11 +78,26 @@ class PTWQuickCheckDBTool():
                 config_csv (optional)
                     Path to config.csv file 
                     Read as a list of dictionaries 
+                stream (optional)
+                    Stream the database at write time instead of 
+                    loading it here. 
+                index (optional)
+                    Load the AdminValue index of the database, building 
+                    it if it is missing or out of date. 
 
         '''
+        self.f_in = path.normpath(qcw_in)
+        self.stream = stream
+        self.rules = [] # applied by write_new_qcw_file in streaming mode 
+        self.rule_counts = []
+        self.n_changed = 0
         try:
-            with open(path.normpath(qcw_in), 'rb') as f:
-                self.qcw_in = xmld.parse(f)
+            if stream:
+                with open(self.f_in, 'rb'):
+                    self.qcw_in = None
+            else:
+                with open(self.f_in, 'rb') as f:
+                    self.qcw_in = xmld.parse(f)
         except FileNotFoundError:
             print("ERROR: No database file found.")
             self.qcw_in = None
@@ -51,19 +105,8 @@ class PTWQuickCheckDBTool():
         
 
 
-        try:
-            with open(path.normpath(config_csv), 'r', encoding="utf-8") as f:
-                self.config = list(dr(f))
-        except FileNotFoundError:
-            print("ERROR: Could not find config.csv file.")
-            self.config = None
-            raise FileNotFoundError
-
-        for config in self.config:
-            config["Min"] = "{:e}".format(float(config["Min"]))
-            config["Max"] = "{:e}".format(float(config["Max"]))
-            config["Norm"] = "{:e}".format(float(config["Norm"]))
-            config["Target"] = "{:e}".format(float(config["Target"]))
+        self.config = PTWQuickCheckDBTool.read_config(config_csv)
+        self.index = QCWIndex.open(self.f_in) if index else None
 
 
     def change_all_analysis_params(self, condition: dict = None):
@@ -74,33 +117,22 @@ class PTWQuickCheckDBTool():
                     You my not wish to modify all tags - so provide 
                     the name and value of an AdminValue e.g Energy, SDD, TreatmentUnit 
                     as a dict. Only elements matching this condition will be modified.  
+                    In streaming mode the condition is applied when the file is written. 
         '''
 
+        if self.stream:
+            self.rules.append(dict(condition or {}, config = self.config))
+            return
+
+        if self.index and self.qcw_in:
+            self.apply_rules([dict(condition or {}, config = self.config)])
 
-        if self.config and self.qcw_in:
+        elif self.config and self.qcw_in:
 
             td = self.qcw_in['PTW']['Content']['TrendData']
 
-            for config in self.config:
-
-                for element_record in td:
-
-                    try: 
-                        admin = element_record['Worklist']['AdminData']
-                        if condition: 
-                            if admin['AdminValues'][condition['AdminValue']] == condition['Value']: # CHANGE THIS 
-                                admin['AnalyzeParams'][config['AnalysisParam']]['Min'] = config["Min"]
-                                admin['AnalyzeParams'][config['AnalysisParam']]['Max'] = config ["Max"]
-                                admin['AnalyzeParams'][config['AnalysisParam']]['Norm'] = config ["Norm"]
-                                admin['AnalyzeParams'][config['AnalysisParam']]['Target'] = config ["Target"]
-                        else:
-                            admin['AnalyzeParams'][config['AnalysisParam']]['Min'] = config["Min"]
-                            admin['AnalyzeParams'][config['AnalysisParam']]['Max'] = config ["Max"]
-                            admin['AnalyzeParams'][config['AnalysisParam']]['Norm'] = config ["Norm"]
-                            admin['AnalyzeParams'][config['AnalysisParam']]['Target'] = config ["Target"]
-                    except  KeyError:
-                        print("ERROR: Check all the keyword arguments again.")
-                        raise KeyError
+            for element_record in td:
+                self.apply_config(element_record, condition)
                         
         
     def write_new_qcw_file(self, f_out: str = "MODIFIED.qcw"):
@@ -110,6 +142,10 @@ class PTWQuickCheckDBTool():
                     Path to output .qcw file. 
         '''
 
+        if self.stream:
+            self.stream_new_qcw_file(f_out)
+            return
+
         try:
             with open(path.normpath(f_out), 'w', encoding='utf-8') as f_out:
                 xmld.unparse(self.qcw_in, output = f_out, pretty="true")
@@ -118,4 +154,759 @@ class PTWQuickCheckDBTool():
             print("Could not write new qcw file.")
             raise IOError
 
+    def apply_rules(self, rules: list, dry_run: bool = False):
+        '''
+            Params:
+                rules
+                    List of dicts: AdminValue, Value, config, e.g. from 
+                    read_rules. Each rule sets the AnalyzeParams of its 
+                    config table (default the tool's config) on the elements 
+                    whose AdminValue equals Value, or on every element if 
+                    AdminValue is empty. 
+                dry_run (optional)
+                    Only count the elements each rule would change. 
+
+            The rules are compiled into a dict per AdminValue name, keyed by 
+            value, and all of them are applied in a single pass: one look-up 
+            per AdminValue name for each element, however many rules there 
+            are. Where rules overlap the later one wins, as with repeated 
+            calls to change_all_analysis_params. With an index only the 
+            matching elements are visited, and a dry run does not read 
+            the database at all. 
+
+            Returns the number of elements matched by each rule, in order. 
+            In streaming mode the rules are applied by write_new_qcw_file, 
+            and this returns None unless dry_run. 
+        '''
+        rules = [dict(rule, config = rule.get("config") or self.config) for rule in rules]
+        self.check_rules(rules)
+        compiled = PTWQuickCheckDBTool.compile_rules(rules)
+        counts = [0] * len(rules)
+        changed = 0
+
+        def visit(element_record):
+            nonlocal changed
+            rule_ids = self.match_rules(element_record, compiled)
+            changed += bool(rule_ids)
+            for i in rule_ids:
+                counts[i] += 1
+                if not dry_run:
+                    self.apply_config(element_record, config = rules[i]["config"])
+
+        if self.stream and not dry_run:
+            self.rules.extend(rules)
+            return None
+        if self.index:
+            matches = self.index.match_rules(rules)
+            changed = len(matches)
+            for i in (i for rule_ids in matches.values() for i in rule_ids):
+                counts[i] += 1
+            if not dry_run and self.qcw_in:
+                td = self.qcw_in['PTW']['Content']['TrendData']
+                td = td if isinstance(td, list) else [td]
+                for position, rule_ids in matches.items():
+                    for i in rule_ids:
+                        self.apply_config(td[position], config = rules[i]["config"])
+        elif self.stream:
+            with open(self.f_in, 'rb') as f:
+                xmld.parse(f, item_depth = 3, item_callback = lambda item_path, item: (
+                    item_path[-1][0] != "TrendData" or visit(item) or True))
+        elif self.qcw_in:
+            td = self.qcw_in['PTW']['Content']['TrendData']
+            for element_record in (td if isinstance(td, list) else [td]):
+                visit(element_record)
+        self.rule_counts = counts
+        self.n_changed = changed
+        return counts
+
+    def admin_value_names(self):
+        '''
+            Names of the AdminValues set on any TrendData element, from the 
+            index or the loaded database. None in streaming mode without 
+            an index, where they are not known before the file is read. 
+        '''
+        if self.index:
+            return set(self.index.admin)
+        if not self.qcw_in:
+            return None
+        td = self.qcw_in['PTW']['Content']['TrendData']
+        names = set()
+        for element_record in (td if isinstance(td, list) else [td]):
+            try:
+                admin_values = element_record['Worklist']['AdminData']['AdminValues']
+            except (KeyError, TypeError):
+                continue
+            if isinstance(admin_values, dict):
+                names.update(admin_values)
+        return names
+
+    def check_rules(self, rules: list):
+        '''
+            Warn about rules whose AdminValue no element has, they match 
+            nothing. Returns those AdminValue names. 
+        '''
+        names = self.admin_value_names()
+        if names is None:
+            return []
+        unknown = sorted({rule["AdminValue"] for rule in rules 
+            if rule.get("AdminValue") and rule["AdminValue"] not in names})
+        for name in unknown:
+            print(f"WARNING: No element has the AdminValue {name}, its rules match nothing.")
+        return unknown
+
+    def find(self, condition: dict = None, **admin_values):
+        '''
+            Positions in TrendData of the elements matching a condition 
+            (dict: AdminValue, Value) and/or AdminValue=Value keywords, 
+            e.g. find(Energy = "6 MV", FFF = "Yes"). Uses the index, which 
+            is built if the tool was created without one. 
+        '''
+        if self.index is None:
+            self.index = QCWIndex.open(self.f_in)
+        return self.index.find(condition, **admin_values)
+
+    def get_records(self, positions: list):
+        '''
+            TrendData elements at the given positions, in the same order. 
+            In streaming mode each one is parsed on its own from its byte 
+            range in the index, through mmap. The rest of the file is not read. 
+        '''
+        if not self.stream:
+            td = self.qcw_in['PTW']['Content']['TrendData']
+            td = td if isinstance(td, list) else [td]
+            return [td[position] for position in positions]
+
+        if self.index is None:
+            self.index = QCWIndex.open(self.f_in)
+        return [xmld.parse(data)['TrendData'] for data in self.index.read(positions)]
+
+    def write_records(self, records: dict):
+        '''
+            Params:
+                records
+                    dict: position --> changed TrendData element, e.g. 
+                    from get_records. 
+
+            Write the elements straight into the input database file. Each 
+            one is formatted with the line ending, indent and empty tags of 
+            the element it replaces (see QCWIndex.layout), so an unchanged 
+            layout keeps its length and is patched in place. Otherwise, e.g. 
+            several children on one line, which xmltodict cannot reproduce, 
+            the file is rewritten (see QCWIndex.write). The index (byte 
+            ranges and AdminValues) is kept up to date. 
+
+            Returns the number of elements patched in place. 
+        '''
+        if self.index is None:
+            self.index = QCWIndex.open(self.f_in)
+        self.index.refresh() # before the AdminValues are re-indexed 
+        positions = list(records)
+        patches = {}
+        for position, raw in zip(positions, self.index.read(positions)):
+            element_record = records[position]
+            patches[position] = xmld.unparse(
+                {'TrendData': element_record}, full_document = False, 
+                **QCWIndex.layout(raw)).strip().encode("utf-8")
+            try:
+                admin_values = element_record['Worklist']['AdminData']['AdminValues'] or {}
+            except (KeyError, TypeError):
+                admin_values = {}
+            self.index.set_admin_values(position, admin_values)
+        in_place = self.index.write(patches)
+
+        if self.qcw_in:
+            td = self.qcw_in['PTW']['Content']['TrendData']
+            for position, element_record in records.items():
+                if isinstance(td, list):
+                    td[position] = element_record
+                else:
+                    self.qcw_in['PTW']['Content']['TrendData'] = element_record
+        return in_place
+
+    def match_rules(self, element_record: dict, compiled: tuple):
+        '''
+            Indexes of the compiled rules, in order, that match one TrendData element. 
+        '''
+        by_admin, always = compiled
+        matched = list(always)
+        try: 
+            admin_values = element_record['Worklist']['AdminData']['AdminValues'] or {}
+        except (KeyError, TypeError):
+            admin_values = {}
+        if not isinstance(admin_values, dict):
+            admin_values = {} # no AdminValues, as in QCWIndex.match_rules 
+        for name, by_value in by_admin.items():
+            value = admin_values.get(name) # a missing AdminValue matches no rule 
+            if isinstance(value, str) and value in by_value:
+                matched.extend(by_value[value])
+        return sorted(matched) if len(by_admin) + bool(always) > 1 else matched
+
+    def apply_config(self, element_record: dict, condition: dict = None, config: list = None):
+        '''
+            Set the Min, Max, Norm and Target of every config row (default 
+            the tool's config) on one TrendData element, if it matches condition. 
+            Returns True if the element was changed. 
+        '''
+        try: 
+            admin = element_record['Worklist']['AdminData']
+            admin_values = admin['AdminValues'] if isinstance(admin['AdminValues'], dict) else {}
+            if condition and admin_values.get(condition['AdminValue']) != condition['Value']:
+                return False # a missing AdminValue does not match either 
+            for config in (config or self.config):
+                admin['AnalyzeParams'][config['AnalysisParam']]['Min'] = config["Min"]
+                admin['AnalyzeParams'][config['AnalysisParam']]['Max'] = config ["Max"]
+                admin['AnalyzeParams'][config['AnalysisParam']]['Norm'] = config ["Norm"]
+                admin['AnalyzeParams'][config['AnalysisParam']]['Target'] = config ["Target"]
+        except  (KeyError, TypeError):
+            print("ERROR: Check all the keyword arguments again.")
+            raise KeyError
+        return True
+
+    def stream_new_qcw_file(self, f_out: str = "MODIFIED.qcw", chunk_size: int = 1 << 16):
+        '''
+            Write the modified database straight from the input file, one 
+            TrendData element in memory at a time. 
+            The output is written to a temp file in the same folder and only 
+            renamed over f_out once complete, so f_out may be the input file 
+            and is left untouched if the input cannot be processed. 
+        '''
+        f_out = path.normpath(f_out)
+        fd, tmp = mkstemp(
+            suffix = ".tmp", prefix = path.basename(f_out) + ".", 
+            dir = path.dirname(f_out) or ".")
+        try:
+            with open(fd, 'w', encoding='utf-8') as out, open(self.f_in, 'rb') as f:
+                compiled = PTWQuickCheckDBTool.compile_rules(self.rules)
+                matches = self.index.match_rules(self.rules) if self.index else None
+                counts = [0] * len(self.rules)
+                position = -1
+                changed = 0
+
+                def transform(element_record):
+                    nonlocal position, changed
+                    position += 1
+                    if matches is None:
+                        rule_ids = self.match_rules(element_record, compiled)
+                    else:
+                        rule_ids = matches.get(position, ())
+                    changed += bool(rule_ids)
+                    for i in rule_ids:
+                        counts[i] += 1
+                        self.apply_config(element_record, config = self.rules[i]["config"])
+                    return element_record
+
+                writer = QCWStreamWriter(out, transform)
+                for chunk in iter(lambda: f.read(chunk_size), b""):
+                    writer.feed(chunk)
+                writer.close()
+            copymode(self.f_in, tmp) # mkstemp files are private 
+            replace(tmp, f_out)
+            self.rule_counts = counts
+            self.n_changed = changed
+        except BaseException:
+            if path.exists(tmp):
+                remove(tmp)
+            print("Could not write new qcw file.")
+            raise
+
+    # -- static methods -- not dependent on object state 
+    @staticmethod
+    def read_config(config_csv: str):
+        '''
+            config.csv rows: AnalysisParam, Min, Max, Norm, Target, with the 
+            numbers formatted as in the .qcw file. 
+        '''
+        try:
+            with open(path.normpath(config_csv), 'r', encoding="utf-8") as f:
+                config = list(dr(f))
+        except FileNotFoundError:
+            print("ERROR: Could not find config.csv file.")
+            raise FileNotFoundError
+
+        for row in config:
+            row["Min"] = "{:e}".format(float(row["Min"]))
+            row["Max"] = "{:e}".format(float(row["Max"]))
+            row["Norm"] = "{:e}".format(float(row["Norm"]))
+            row["Target"] = "{:e}".format(float(row["Target"]))
+        return config
+
+    @staticmethod
+    def read_rules(rules_csv: str):
+        '''
+            Rule set from a csv file with the columns AdminValue, Value, Config: 
+
+                AdminValue,Value,Config
+                Info,6X Output. Energy. Flat and Symm.,config.csv
+                FFF,Yes,config_fff.csv
+
+            Config is a config.csv path, relative to the rules file. An empty 
+            AdminValue matches every element, an empty Config uses the 
+            tool's config. Returns a list of dicts for apply_rules. 
+        '''
+        try:
+            with open(path.normpath(rules_csv), 'r', encoding="utf-8") as f:
+                rows = list(dr(f))
+        except FileNotFoundError:
+            print("ERROR: Could not find rules file.")
+            raise FileNotFoundError
+
+        tables = {} # each config.csv is read once 
+        rules = []
+        for row in rows:
+            config_csv = (row.get("Config") or "").strip()
+            if config_csv:
+                config_csv = path.join(path.dirname(path.abspath(rules_csv)), config_csv)
+                if config_csv not in tables:
+                    tables[config_csv] = PTWQuickCheckDBTool.read_config(config_csv)
+            rules.append({
+                "AdminValue": (row.get("AdminValue") or "").strip(),
+                "Value": row.get("Value") or "",
+                "config": tables.get(config_csv),
+            })
+        return rules
+
+    @staticmethod
+    def compile_rules(rules: list):
+        '''
+            (by_admin, always): AdminValue name --> {Value --> rule indexes}, 
+            and the indexes of the rules without a condition. 
+        '''
+        by_admin, always = {}, []
+        for i, rule in enumerate(rules):
+            if rule.get("AdminValue"):
+                by_admin.setdefault(rule["AdminValue"], {}).setdefault(rule["Value"], []).append(i)
+            else:
+                always.append(i)
+        return by_admin, always
+
+
+class QCWIndex():
+    '''
+        Inverted index of the AdminValues of a .qcw database: 
+        AdminValue name --> value --> positions of the TrendData elements. 
+
+        Saved as JSON next to the database (LA1.qcw --> LA1.qcw.index.json) 
+        with the size and mtime of the file it was built from. An index 
+        that no longer matches the database is rebuilt by open. 
+
+        The byte range of each TrendData element is kept too, so single 
+        elements can be read from, or written back to, the file through 
+        mmap without reading the rest of it. 
+
+        Example usage: 
+
+            index = QCWIndex.open("LA1.qcw")
+            positions = index.find(Energy = "6 MV", FFF = "Yes")
+            index.values("TreatmentUnit")    # {"LA1": 4120, ...}
+            raw = index.read(positions[:10])
+
+    '''
+
+    SUFFIX = ".index.json"
+    ADMIN_VALUES = ("PTW", "Content", "TrendData", "Worklist", "AdminData", "AdminValues")
+
+    def __init__(self, qcw_in: str):
+        '''
+            Params:
+                qcw_in 
+                    Path to the .qcw database file. The index is empty 
+                    until load or build. 
+        '''
+        self.f_in = path.normpath(qcw_in)
+        self.f_index = self.f_in + QCWIndex.SUFFIX
+        self.size = None
+        self.mtime_ns = None
+        self.count = 0 # TrendData elements 
+        self.admin = {} # name --> value --> [positions] 
+        self.offsets = [] # [start, end] byte range of each element 
+
+    def is_current(self):
+        '''
+            True if the index was built from the database as it is now. 
+        '''
+        try:
+            st = stat(self.f_in)
+        except FileNotFoundError:
+            return False
+        return (self.size, self.mtime_ns) == (st.st_size, st.st_mtime_ns)
+
+    def load(self):
+        '''
+            Read the saved index. Returns False if there is none, or it 
+            is out of date. 
+        '''
+        try:
+            with open(self.f_index, 'r', encoding="utf-8") as f:
+                saved = json.load(f)
+            self.size, self.mtime_ns = saved["size"], saved["mtime_ns"]
+            self.count, self.admin = saved["count"], saved["admin"]
+            self.offsets = saved["offsets"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return self.is_current()
+
+    def build(self):
+        '''
+            Index the database in one streaming pass with expat. The byte 
+            range of each element and the text of its AdminValues are 
+            kept, with the values xmltodict 
+            would give: whitespace stripped, and elements that are empty, 
+            repeated or have attributes or children left out. 
+        '''
+        st = stat(self.f_in)
+        admin = {}
+        stack = [] # element names 
+        element = {} # AdminValues of the current TrendData element 
+        value = None # [name, text, valid] of the current AdminValue 
+        starts, end_tags = [], []
+        count = 0
+
+        def start(name, attrs):
+            nonlocal value
+            stack.append(name)
+            if len(stack) == 3 and tuple(stack) == QCWIndex.ADMIN_VALUES[:3]:
+                starts.append(parser.CurrentByteIndex)
+            elif len(stack) == len(QCWIndex.ADMIN_VALUES) + 1 and tuple(stack[:-1]) == QCWIndex.ADMIN_VALUES:
+                value = [name, [], not attrs]
+            elif value is not None:
+                value[2] = False
+
+        def end(name):
+            nonlocal value, count
+            stack.pop()
+            if value is not None and len(stack) == len(QCWIndex.ADMIN_VALUES):
+                text = "".join(value[1]).strip()
+                element[value[0]] = text if value[2] and text and value[0] not in element else None
+                value = None
+            elif len(stack) == 2 and name == "TrendData":
+                end_tags.append(parser.CurrentByteIndex)
+                for admin_name, admin_value in element.items():
+                    if admin_value is not None:
+                        admin.setdefault(admin_name, {}).setdefault(admin_value, []).append(count)
+                element.clear()
+                count += 1
+
+        def text(data):
+            if value is not None:
+                value[1].append(data)
+
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = text
+        with open(self.f_in, 'rb') as f:
+            parser.ParseFile(f)
+            offsets = []
+            if count:
+                with mmap(f.fileno(), 0, access = ACCESS_READ) as mm:
+                    # expat gives the start of the end tag, the element ends at its > 
+                    offsets = [[start, mm.find(b">", end_tag) + 1] for start, end_tag in zip(starts, end_tags)]
+        self.size, self.mtime_ns = st.st_size, st.st_mtime_ns
+        self.count, self.admin, self.offsets = count, admin, offsets
+
+    def save(self):
+        '''
+            Write the index next to the database, through a temp file. 
+        '''
+        tmp = self.f_index + ".tmp"
+        try:
+            with open(tmp, 'w', encoding="utf-8") as f:
+                json.dump({
+                    "size": self.size, "mtime_ns": self.mtime_ns,
+                    "count": self.count, "admin": self.admin, "offsets": self.offsets,
+                }, f)
+            replace(tmp, self.f_index)
+        except IOError:
+            print("Could not write index file.")
+            raise IOError
+
+    def refresh(self):
+        '''
+            Rebuild and save the index if the database has changed since. 
+        '''
+        if not self.is_current():
+            self.build()
+            self.save()
+
+    def read(self, positions: list):
+        '''
+            Raw bytes of the TrendData elements at the given positions, 
+            sliced from an mmap of the database. 
+        '''
+        self.refresh()
+        if not positions:
+            return []
+        with open(self.f_in, 'rb') as f, mmap(f.fileno(), 0, access = ACCESS_READ) as mm:
+            return [mm[start:end] for start, end in (self.offsets[position] for position in positions)]
+
+    def write(self, patches: dict, chunk_size: int = 1 << 20):
+        '''
+            Params:
+                patches
+                    dict: position --> new bytes of the TrendData element 
+
+            If every element keeps its length they are patched in place 
+            through mmap. Otherwise the database is copied to a temp file 
+            next to it with the new elements and renamed over it, so the 
+            file is never left half rewritten. Byte ranges, size and mtime 
+            are updated and the index saved. 
+
+            Returns the number of elements patched in place, 0 if the file 
+            was rewritten. 
+        '''
+        self.refresh()
+        positions = sorted(patches)
+        resized = [position for position in positions 
+            if len(patches[position]) != self.offsets[position][1] - self.offsets[position][0]]
+        first = resized[0] if resized else self.count
+        in_place = [position for position in positions if position < first]
+
+        try:
+            if resized:
+                self._rewrite(patches, positions, chunk_size)
+            elif in_place:
+                with open(self.f_in, 'r+b') as f, mmap(f.fileno(), 0) as mm:
+                    for position in in_place:
+                        start, end = self.offsets[position]
+                        mm[start:end] = patches[position]
+                    mm.flush()
+        except IOError:
+            print("Could not write to the qcw file.")
+            raise
+
+        shift = 0 # change in length of the file before each element 
+        for position in range(first, self.count):
+            start, end = self.offsets[position]
+            length = len(patches[position]) if position in patches else end - start
+            self.offsets[position] = [start + shift, start + shift + length]
+            shift += length - (end - start)
+        st = stat(self.f_in)
+        self.size, self.mtime_ns = st.st_size, st.st_mtime_ns
+        self.save()
+        return 0 if resized else len(in_place)
+
+    def _rewrite(self, patches: dict, positions: list, chunk_size: int):
+        '''
+            Copy the database with the patched elements to a temp file in 
+            the same folder and rename it over the database. 
+        '''
+        fd, tmp = mkstemp(
+            suffix = ".tmp", prefix = path.basename(self.f_in) + ".", 
+            dir = path.dirname(self.f_in) or ".")
+        try:
+            with open(fd, 'wb') as out, open(self.f_in, 'rb') as f, \
+                    mmap(f.fileno(), 0, access = ACCESS_READ) as mm:
+                cursor = 0
+                for position in positions + [None]:
+                    start, end = self.offsets[position] if position is not None else (len(mm), None)
+                    for i in range(cursor, start, chunk_size):
+                        out.write(mm[i:min(start, i + chunk_size)])
+                    if position is not None:
+                        out.write(patches[position])
+                        cursor = end
+            copymode(self.f_in, tmp) # mkstemp files are private 
+            replace(tmp, self.f_in)
+        except BaseException:
+            if path.exists(tmp):
+                remove(tmp)
+            raise
+
+    def set_admin_values(self, position: int, admin_values: dict):
+        '''
+            Re-index the AdminValues of the element at position. 
+        '''
+        for name in list(self.admin):
+            for value in list(self.admin[name]):
+                positions = self.admin[name][value]
+                i = bisect_left(positions, position)
+                if i < len(positions) and positions[i] == position:
+                    del positions[i]
+                    if not positions:
+                        del self.admin[name][value]
+            if not self.admin[name]:
+                del self.admin[name]
+        for name, value in admin_values.items():
+            if isinstance(value, str):
+                insort(self.admin.setdefault(name, {}).setdefault(value, []), position)
+
+    def find(self, condition: dict = None, **admin_values):
+        '''
+            Sorted positions of the elements matching every AdminValue given, 
+            as a condition (dict: AdminValue, Value) and/or keywords. 
+            No AdminValues --> every element. 
+        '''
+        if condition:
+            admin_values[condition['AdminValue']] = condition['Value']
+        if not admin_values:
+            return list(range(self.count))
+        found = None
+        for name, value in admin_values.items():
+            positions = self.admin.get(name, {}).get(value, [])
+            found = set(positions) if found is None else found.intersection(positions)
+            if not found:
+                return []
+        return sorted(found)
+
+    def values(self, name: str):
+        '''
+            Number of elements for each value of the AdminValue name. 
+        '''
+        return {value: len(positions) for value, positions in self.admin.get(name, {}).items()}
+
+    def match_rules(self, rules: list):
+        '''
+            Position --> indexes of the rules (see apply_rules) matching the 
+            element there, in rule order. Elements no rule matches are left out. 
+        '''
+        matches = {}
+        for i, rule in enumerate(rules):
+            if rule.get("AdminValue"):
+                positions = self.admin.get(rule["AdminValue"], {}).get(rule["Value"], [])
+            else:
+                positions = range(self.count)
+            for position in positions:
+                matches.setdefault(position, []).append(i)
+        return matches
+
+    # -- static methods -- not dependent on object state 
+    @staticmethod
+    def layout(raw: bytes):
+        '''
+            xmltodict.unparse keywords that reproduce the whitespace of a 
+            raw TrendData element: line ending, indent unit and depth, and 
+            short <Empty/> tags. Defaults to the write_new_qcw_file format 
+            (tabs at depth 2) if the indent cannot be worked out. 
+        '''
+        lines = raw.split(b"\n")
+        if len(lines) < 3:
+            return {"pretty": False, "short_empty_elements": b"/>" in raw}
+        newl = "\r\n" if all(line.endswith(b"\r") for line in lines[:-1]) else "\n"
+        child = lines[1][:len(lines[1]) - len(lines[1].lstrip())].decode("utf-8")
+        base = lines[-1][:len(lines[-1]) - len(lines[-1].lstrip())].decode("utf-8")
+        indent, depth = "\t", 2
+        if child.startswith(base) and len(child) > len(base):
+            unit = child[len(base):]
+            if base == unit * (len(base) // len(unit)):
+                indent, depth = unit, len(base) // len(unit)
+        return {"pretty": True, "newl": newl, "indent": indent, "depth": depth, 
+                "short_empty_elements": b"/>" in raw}
+
+    @staticmethod
+    def open(qcw_in: str):
+        '''
+            Saved index of qcw_in, built and saved first if it is missing 
+            or out of date. 
+        '''
+        index = QCWIndex(qcw_in)
+        if not index.load():
+            index.build()
+            index.save()
+        return index
+
+
+class QCWStreamWriter():
+    '''
+        SAX-style copy of a .qcw database, in the format of 
+        xmltodict.unparse(pretty = True). 
+
+        Elements outside PTW/Content/TrendData are copied as they are read. 
+        The bytes of each TrendData element are cut out of the input, parsed 
+        with xmltodict, passed to transform and written back at their depth. 
+        Only the current TrendData element is held in memory. 
+    '''
+    ITEM = ("PTW", "Content", "TrendData")
+
+    def __init__(self, out, transform):
+        self.transform = transform
+        self._out = out
+        self._gen = XMLGenerator(out, 'utf-8')
+        self._gen.startDocument()
+        self._stack = [] # [name, attrs, text, written] of open elements 
+        self._buf = bytearray() # input from _buf_start on 
+        self._buf_start = 0
+        self._item_start = None # input offset of the open TrendData element 
+        self._last = 0 # input offset of the last event, expat may not be past it yet 
+        self._item_depth = 0
+        self._parser = expat.ParserCreate()
+        self._parser.ordered_attributes = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._text
+
+    def feed(self, data: bytes):
+        self._buf += data
+        self._parser.Parse(data, False)
+        # keep only the bytes of an unfinished TrendData element, or those 
+        # expat has not reported yet 
+        keep_from = self._last if self._item_start is None else self._item_start
+        del self._buf[:keep_from - self._buf_start]
+        self._buf_start = keep_from
+
+    def close(self):
+        self._parser.Parse(b"", True)
+        self._gen.endDocument()
+
+    def _start(self, name, attrs):
+        self._last = self._parser.CurrentByteIndex
+        if self._item_depth:
+            self._item_depth += 1
+            return
+        if tuple(frame[0] for frame in self._stack) + (name,) == self.ITEM:
+            self._open_parent()
+            self._item_start = self._parser.CurrentByteIndex
+            self._item_depth = 1
+            self._parser.CharacterDataHandler = None # xmltodict reads the text 
+            return
+        self._open_parent()
+        self._stack.append([name, dict(zip(attrs[::2], attrs[1::2])), [], False])
+
+    def _end(self, name):
+        self._last = self._parser.CurrentByteIndex
+        if self._item_depth:
+            self._item_depth -= 1
+            if not self._item_depth:
+                self._write_item()
+                self._parser.CharacterDataHandler = self._text
+            return
+        name, attrs, text, written = self._stack.pop()
+        depth = len(self._stack)
+        text = "".join(text).strip() or None
+        if not written:
+            self._gen.ignorableWhitespace(depth * '\t')
+            self._gen.startElement(name, AttributesImpl(attrs))
+        if text is not None:
+            self._gen.characters(text)
+        if written:
+            self._gen.ignorableWhitespace(depth * '\t')
+        self._gen.endElement(name)
+        if depth:
+            self._gen.ignorableWhitespace('\n')
+
+    def _text(self, data):
+        if self._stack:
+            self._stack[-1][2].append(data)
+
+    def _open_parent(self):
+        '''
+            Write the start tag of the innermost open element, now that it 
+            is known to have children. 
+        '''
+        if self._stack and not self._stack[-1][3]:
+            name, attrs, text, written = self._stack[-1]
+            self._gen.ignorableWhitespace((len(self._stack) - 1) * '\t')
+            self._gen.startElement(name, AttributesImpl(attrs))
+            self._gen.ignorableWhitespace('\n')
+            self._stack[-1][3] = True
+
+    def _write_item(self):
+        start = self._item_start - self._buf_start
+        end = self._buf.index(b">", self._parser.CurrentByteIndex - self._buf_start) + 1
+        item = xmld.parse(bytes(self._buf[start:end]))
+        name = self.ITEM[-1]
+        xmld.unparse(
+            {name: self.transform(item[name])},
+            output = self._out, full_document = False, pretty = True,
+            depth = len(self._stack))
+        self._item_start = None
+
 
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Rebaseline a directory of QuickCheck databases in one go, e.g. one .qcw per
+linac per year after a new reference.
+
+Every .qcw file in a directory (or matching a glob) gets the same rule set
+(rules.csv, see PTWQuickCheckDBTool.read_rules) or, without one, the
+config.csv applied to all of its TrendData elements. The files are spread over
+a process pool, and each is streamed (see PTWQuickCheckDBTool stream = True),
+so memory per worker stays flat whatever the size of the database.
+
+Each output is written to a temp file in the output folder and renamed into
+place once complete. A failed file never leaves a partial .qcw behind, and an
+existing output is only replaced by a finished one.
+
+A summary of the elements changed by each rule, per file, is printed at the
+end and can be saved as csv.
+
+Run from the quick_check folder, like quick_check_main.py:
+
+    python quick_check_batch.py "D:/QuickCheck/*.qcw" --rules rules.csv --workers 4
+    python quick_check_batch.py D:/QuickCheck --config config.csv --out-dir D:/Rebaselined
+    python quick_check_batch.py D:/QuickCheck --rules rules.csv --dry-run
+
+"""
+
+import argparse
+import csv
+import glob
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from quick_check import PTWQuickCheckDBTool
+
+SUFFIX = "_MODIFIED"
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = "QuickCheck .qcw batch rebaselining")
+    parser.add_argument("qcw", help = "directory of .qcw files, or a glob")
+    parser.add_argument("--config", default = "config.csv",
+                        help = "config.csv, the default table of the rules")
+    parser.add_argument("--rules", default = None,
+                        help = "rules csv, default the config applied to every element")
+    parser.add_argument("--out-dir", default = None,
+                        help = "output folder, default next to each input")
+    parser.add_argument("--suffix", default = SUFFIX,
+                        help = "added to the output file names")
+    parser.add_argument("--workers", type = int, default = None,
+                        help = "processes, default one per CPU")
+    parser.add_argument("--dry-run", action = "store_true",
+                        help = "only count the elements each rule would change")
+    parser.add_argument("--summary", default = None, help = "also write the summary to this csv")
+    return parser.parse_args(argv)
+
+
+def find_qcw_files(qcw, suffix = SUFFIX):
+    '''
+        Sorted .qcw files in a directory, or matching a glob. Outputs of an
+        earlier run (names ending in suffix) are left out.
+    '''
+    pattern = os.path.join(qcw, "*.qcw") if os.path.isdir(qcw) else qcw
+    return sorted(
+        os.path.normpath(f_in) for f_in in glob.glob(pattern)
+        if os.path.isfile(f_in) and not (suffix and os.path.splitext(f_in)[0].endswith(suffix))
+    )
+
+
+def output_path(f_in, out_dir = None, suffix = SUFFIX):
+    name, ext = os.path.splitext(os.path.basename(f_in))
+    return os.path.join(out_dir or os.path.dirname(f_in), name + suffix + ext)
+
+
+def rebaseline_file(f_in, f_out, config_csv, rules, dry_run = False):
+    '''
+        Apply rules (or the config to every element) to one database and
+        write it to f_out through a temp file in the same folder.
+        Runs in a worker process. Returns the summary row of the file.
+    '''
+    start = time.time()
+    row = {"file": f_in, "output": None if dry_run else f_out, "elements changed": 0,
+           "rule counts": [], "seconds": 0.0, "error": None}
+    tmp = None
+    try:
+        tool = PTWQuickCheckDBTool(qcw_in = f_in, config_csv = config_csv, stream = True)
+        tool.apply_rules(rules or [{}], dry_run = dry_run)
+        if not dry_run:
+            fd, tmp = tempfile.mkstemp(
+                suffix = ".tmp", prefix = os.path.basename(f_out) + ".",
+                dir = os.path.dirname(f_out) or ".")
+            os.close(fd)
+            tool.write_new_qcw_file(f_out = tmp)
+            shutil.copymode(f_in, tmp) # mkstemp files are private
+            os.replace(tmp, f_out)
+            tmp = None
+        row["elements changed"] = tool.n_changed
+        row["rule counts"] = tool.rule_counts
+    except Exception as e: # reported in the summary, the other files carry on
+        row["error"] = f"{type(e).__name__}: {e}"
+        row["output"] = None
+    finally:
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+    row["seconds"] = round(time.time() - start, 2)
+    return row
+
+
+def run_batch(f_ins, config_csv, rules = None, out_dir = None, suffix = SUFFIX,
+              workers = None, dry_run = False):
+    '''
+        Rebaseline every file in f_ins on a process pool.
+        Returns the summary rows in the order of f_ins.
+    '''
+    if out_dir and not dry_run:
+        os.makedirs(out_dir, exist_ok = True)
+    config_csv = os.path.abspath(config_csv)
+    rows = {}
+    with ProcessPoolExecutor(max_workers = workers) as ex:
+        futures = {
+            ex.submit(rebaseline_file, f_in, output_path(f_in, out_dir, suffix),
+                      config_csv, rules, dry_run): f_in
+            for f_in in f_ins
+        }
+        for future in as_completed(futures):
+            row = future.result()
+            rows[futures[future]] = row
+            print(f"{row['file']}: " + (row["error"] or f"{row['elements changed']} elements changed"))
+    return [rows[f_in] for f_in in f_ins]
+
+
+def rule_names(rules = None):
+    return [
+        f"{rule['AdminValue']}={rule['Value']}" if rule.get("AdminValue") else "all"
+        for rule in (rules or [{}])
+    ]
+
+
+def summary(rows, rules = None):
+    '''
+        Consolidated summary of a batch: elements changed per file and per rule.
+    '''
+    names = rule_names(rules)
+    lines = ["QuickCheck batch rebaselining", f"Rules: {', '.join(names)}"]
+    for row in rows:
+        counts = ", ".join(f"{name}: {count}" for name, count in zip(names, row["rule counts"]))
+        result = row["error"] or f"{row['elements changed']} elements changed ({counts})"
+        lines.append(f"{os.path.basename(row['file'])}: {result}, {row['seconds']}s")
+    failed = sum(row["error"] is not None for row in rows)
+    lines.append(f"Files: {len(rows)}, failed: {failed}, "
+                 f"elements changed: {sum(row['elements changed'] for row in rows)}")
+    return "\n".join(lines)
+
+
+def write_summary(rows, f_summary, rules = None):
+    names = rule_names(rules)
+    with open(f_summary, "w", newline = "", encoding = "utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "output", "elements changed", *names, "seconds", "error"])
+        for row in rows:
+            counts = row["rule counts"] or [""] * len(names)
+            writer.writerow([row["file"], row["output"] or "", row["elements changed"],
+                             *counts, row["seconds"], row["error"] or ""])
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    f_ins = find_qcw_files(args.qcw, args.suffix)
+    if not f_ins:
+        print(f"ERROR: No .qcw files found in {args.qcw}")
+        return 1
+    rules = PTWQuickCheckDBTool.read_rules(args.rules) if args.rules else None
+    PTWQuickCheckDBTool.read_config(args.config) # fail before starting the pool
+
+    rows = run_batch(f_ins, args.config, rules, out_dir = args.out_dir, suffix = args.suffix,
+                     workers = args.workers, dry_run = args.dry_run)
+    print(summary(rows, rules))
+    if args.summary:
+        write_summary(rows, args.summary, rules)
+    return 1 if any(row["error"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for TrackitExporter.exe, for benchmarking and testing without a
+TRACK-IT server.
+
+Accepts the same arguments as the real export tool:
+
+    -i <xml file> -o <server> [-m 1 -u <user> -p <password>]
+
+then waits, succeeds or fails as configured, and appends one JSON line per
+call to the record file: the arguments (password masked), the size of the
+xml, the number of Measurements it holds, whether it parsed, the latency and
+the return code.
+
+Configured by option or environment variable:
+
+    --latency     FAKE_EXPORTER_LATENCY     mean seconds per call (default 0.5)
+    --jitter      FAKE_EXPORTER_JITTER      +/- seconds, uniform (default 0.1)
+    --fail-rate   FAKE_EXPORTER_FAIL_RATE   fraction of calls that fail (default 0)
+    --record      FAKE_EXPORTER_RECORD      JSON lines file (default ./log/fake_exporter.jsonl)
+
+Example usage, as the import_client_path of a PTWExportPool command:
+
+    client = [sys.executable, "tools/fake_exporter.py", "--latency", "0.2"]
+    PTWExportPool.command(client, f_xml, track_it_ip, USERNAME, PASSWORD)
+
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+FAIL_CODE = 1
+
+
+def parse_args(argv = None):
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description = "Stand-in for TrackitExporter.exe")
+    parser.add_argument("-i", dest = "f_in", required = True, help = "xml file to import")
+    parser.add_argument("-o", dest = "server", required = True, help = "TRACK-IT server")
+    parser.add_argument("-m", dest = "mode", default = None)
+    parser.add_argument("-u", dest = "user", default = None)
+    parser.add_argument("-p", dest = "password", default = None)
+    parser.add_argument("--latency", type = float,
+                        default = float(env("FAKE_EXPORTER_LATENCY", 0.5)))
+    parser.add_argument("--jitter", type = float,
+                        default = float(env("FAKE_EXPORTER_JITTER", 0.1)))
+    parser.add_argument("--fail-rate", type = float,
+                        default = float(env("FAKE_EXPORTER_FAIL_RATE", 0.0)))
+    parser.add_argument("--record",
+                        default = env("FAKE_EXPORTER_RECORD",
+                                      os.path.join("log", "fake_exporter.jsonl")))
+    return parser.parse_args(argv)
+
+
+def inspect_xml(f_in):
+    '''
+        Size, number of Measurements and parse error (None if it parsed) of f_in.
+    '''
+    try:
+        size = os.path.getsize(f_in)
+        root = ET.parse(f_in).getroot()
+        return size, len(root.findall("./Content/Measurements/Measurement")), None
+    except (OSError, ET.ParseError) as e:
+        return None, 0, str(e)
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    start = time.monotonic()
+
+    size, measurements, error = inspect_xml(args.f_in)
+    time.sleep(max(0.0, args.latency + random.uniform(-args.jitter, args.jitter)))
+    failed = error is not None or random.random() < args.fail_rate
+    returncode = FAIL_CODE if failed else 0
+
+    record = {
+        "time": time.time(),
+        "pid": os.getpid(),
+        "input": args.f_in,
+        "server": args.server,
+        "mode": args.mode,
+        "user": args.user,
+        "password": "***" if args.password else None,
+        "bytes": size,
+        "measurements": measurements,
+        "parse_error": error,
+        "latency": round(time.monotonic() - start, 4),
+        "returncode": returncode,
+    }
+    os.makedirs(os.path.dirname(args.record) or ".", exist_ok = True)
+    # one write per line on an O_APPEND file, so concurrent calls do not interleave
+    fd = os.open(args.record, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, (json.dumps(record) + "\n").encode("utf-8"))
+    finally:
+        os.close(fd)
+
+    if failed:
+        print(f"Import failed: {error or 'simulated failure'}", file = sys.stderr)
+    else:
+        print(f"Imported {measurements} measurements from {args.f_in}")
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
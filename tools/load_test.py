@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end throughput test of the MPC --> TRACK-IT path against the stand-in
+exporter, tools/fake_exporter.py.
+
+Generates Results.csv folders for N synthetic linacs x energies x days, then
+runs them through the mpc_pipeline generator stages that mpc_service.py runs:
+
+    discover  - Results.csv files acquired since the start date, not yet processed
+    read      - MPCPTWXml and build_ptw_xml for each file
+    unsent    - drop records already in the PTWSentIndex
+    write     - validate and write one xml per batch_size records
+    export    - export_batches on a bounded queue and a PTWExportPool
+
+The stages run interleaved, as in the service. The time spent in each one
+(excluding the stages before it) is reported with records/second, together
+with end to end throughput and exporter latency percentiles as seen by the
+pool and by the fake exporter. The state store and sent index live in the
+work directory, so every run starts clean.
+
+Run from the repository root:
+
+    python -m tools.load_test --linacs 4 --days 30 --latency 0.5 --workers 4
+
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from mpc.config_registry import MPCConfig
+from mpc.mpc_state import MPCStateStore
+from mpc.mpc_pipeline import RunStats, discover, read, unsent, write_batches, export_batches
+from modules.ptw_dedup import PTWSentIndex
+from modules.ptw_export import PTWExportPool
+
+CONFIG_DIR = os.path.join("mpc", "config")
+FAKE_EXPORTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_exporter.py")
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = "MPC --> TRACK-IT load test")
+    parser.add_argument("--linacs", type = int, default = 4, help = "synthetic linacs")
+    parser.add_argument("--energies", type = int, default = None,
+                        help = "energies per linac, default all in energies.csv")
+    parser.add_argument("--days", type = int, default = 7, help = "MPC runs per linac and energy")
+    parser.add_argument("--batch-size", type = int, default = 50, help = "records per xml")
+    parser.add_argument("--workers", type = int, default = 4, help = "concurrent exporters")
+    parser.add_argument("--queue-size", type = int, default = 8,
+                        help = "written xml files waiting for an exporter")
+    parser.add_argument("--timeout", type = float, default = 120)
+    parser.add_argument("--retries", type = int, default = 2)
+    parser.add_argument("--backoff", type = float, default = 0.5)
+    parser.add_argument("--latency", type = float, default = 0.5,
+                        help = "fake exporter mean seconds per call")
+    parser.add_argument("--jitter", type = float, default = 0.1)
+    parser.add_argument("--fail-rate", type = float, default = 0.0)
+    parser.add_argument("--work-dir", default = None,
+                        help = "default a temporary directory, removed afterwards")
+    parser.add_argument("--seed", type = int, default = 1)
+    return parser.parse_args(argv)
+
+
+def make_config(config_dir, linacs):
+    '''
+        Copy of mpc/config with one RadiationUnit per synthetic linac.
+        Returns the list of serial numbers.
+    '''
+    os.makedirs(config_dir, exist_ok = True)
+    for f_name in ("config.csv", "energies.csv"):
+        shutil.copy(os.path.join(CONFIG_DIR, f_name), config_dir)
+    sns = [str(8000 + n) for n in range(linacs)]
+    with open(os.path.join(config_dir, "radiation_units.csv"), "w", newline = "") as f:
+        writer = csv.writer(f)
+        writer.writerow(["SN", "RADIATION-UNIT"])
+        writer.writerows([sn, f"LOAD TEST {sn}"] for sn in sns)
+    return sns
+
+
+def make_data(data_dir, config_dir, sns, energies, days, start):
+    '''
+        One Results.csv per linac x energy x day, with random values for
+        every config.csv row. Returns the list of Results.csv paths.
+    '''
+    names = [row["Name [Unit]"] for row in MPCConfig(config_dir).rows] # rules expanded
+    with open(os.path.join(config_dir, "energies.csv"), newline = "") as f:
+        flags = [row["FLAG"] for row in csv.DictReader(f, skipinitialspace = True)]
+    flags = flags[:energies] if energies else flags
+
+    f_paths = []
+    n = 0
+    for sn in sns:
+        for day in range(days):
+            for minute, flag in enumerate(flags):
+                acquired = start + timedelta(days = day, minutes = minute)
+                n += 1
+                mpc_dir = os.path.join(data_dir, "-".join([
+                    "NDS", "WKS", f"SN{sn}",
+                    acquired.strftime("%Y-%m-%d-%H-%M-%S"),
+                    f"{n:04d}", f"BeamCheckTemplate{flag}",
+                ]))
+                os.makedirs(mpc_dir, exist_ok = True)
+                f_path = os.path.join(mpc_dir, "Results.csv")
+                with open(f_path, "w", encoding = "utf-8") as f:
+                    f.write("Name [Unit], Value, Threshold, Status\n")
+                    f.writelines(
+                        f"{name}, {random.uniform(-1, 1):.4f}, 0.5, Pass\n" for name in names)
+                f_paths.append(f_path)
+    return f_paths
+
+
+class LoadStats(RunStats):
+    '''
+        RunStats that also keeps every ExportResult, for the latency report.
+    '''
+    def __init__(self, state = None):
+        super().__init__(state)
+        self.results = []
+
+    def exported(self, result):
+        super().exported(result)
+        self.results.append(result)
+
+
+def timed(items, timings, stage):
+    '''
+        Pass items on, adding the time taken to produce each one to
+        timings[stage]. This includes the stages before, see run.
+    '''
+    items = iter(items)
+    timings[stage] = 0.0
+    while True:
+        t0 = time.perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            timings[stage] += time.perf_counter() - t0
+            return
+        timings[stage] += time.perf_counter() - t0
+        yield item
+
+
+def percentiles(values, points = (50, 90, 99)):
+    '''
+        Nearest-rank percentiles of values, plus the maximum.
+    '''
+    values = sorted(values)
+    if not values:
+        return {}
+    out = {
+        f"p{p}": values[min(len(values) - 1, max(0, -(-p * len(values) // 100) - 1))]
+        for p in points
+    }
+    out["max"] = values[-1]
+    return out
+
+
+def run(args):
+    random.seed(args.seed)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix = "ptw_load_test_")
+    config_dir = os.path.join(work_dir, "config")
+    xml_dir = os.path.join(work_dir, "xml")
+    record = os.path.join(work_dir, "fake_exporter.jsonl")
+    os.makedirs(xml_dir, exist_ok = True)
+    if os.path.exists(record):
+        os.remove(record)
+
+    start = datetime(2022, 11, 16, 7, 0, 0)
+    sns = make_config(config_dir, args.linacs)
+    f_paths = make_data(os.path.join(work_dir, "data"), config_dir,
+                        sns, args.energies, args.days, start)
+
+    fake_exporter = [
+        sys.executable, FAKE_EXPORTER,
+        "--latency", str(args.latency),
+        "--jitter", str(args.jitter),
+        "--fail-rate", str(args.fail_rate),
+        "--record", record,
+    ]
+    pool = PTWExportPool(
+        max_workers = args.workers,
+        timeout = args.timeout,
+        retries = args.retries,
+        backoff = args.backoff,
+    )
+    state = MPCStateStore(os.path.join(work_dir, "mpc_state.sqlite"))
+    sent = PTWSentIndex(os.path.join(work_dir, "sent_index.txt"))
+    stats = LoadStats(state)
+
+    # the service's chain of stages, each one timed as it is pulled
+    inclusive = {}
+    t0 = time.perf_counter()
+    candidates = timed(discover(state, start, stats, root = os.path.join(work_dir, "data"),
+                                sns = sns), inclusive, "discover")
+    records = timed(read(candidates, stats, config_dir = config_dir), inclusive, "read")
+    records = timed(unsent(records, sent, stats), inclusive, "unsent")
+    written = timed(write_batches(records, stats, batch_size = args.batch_size,
+                                  f_prefix = "LOAD_TEST", f_path = xml_dir), inclusive, "write")
+    # the records name TrackitExporter.exe, send them to the fake exporter instead
+    written = ((f_out, (fake_exporter, track_it_ip), files)
+               for f_out, (import_client_path, track_it_ip), files in written)
+    export_batches(written, pool, stats, sent, "load_test", "load_test",
+                   queue_size = args.queue_size)
+    stats.flush()
+    total = time.perf_counter() - t0
+    state.close()
+
+    timings = {}
+    before = 0.0
+    for stage in ("discover", "read", "unsent", "write"):
+        timings[stage] = inclusive[stage] - before
+        before = inclusive[stage]
+    timings["export"] = total - before # waiting for room on the queue, and the last exports
+
+    with open(record) as f:
+        calls = [json.loads(line) for line in f]
+    n_records = stats.n_candidates
+    results = stats.results
+
+    report = {
+        "work_dir": work_dir,
+        "records": n_records,
+        "files": len(results),
+        "exporter_calls": len(calls),
+        "failed_files": sum(not result.ok for result in results),
+        "records_exported": stats.counts["exported"],
+        "records_rejected": stats.counts["rejected"],
+        "seconds": {stage: round(t, 3) for stage, t in timings.items()},
+        "records_per_second": {
+            stage: round(n_records / t, 1) if t else None for stage, t in timings.items()
+        },
+        "end_to_end_records_per_second": round(n_records / total, 1) if total else None,
+        "pool_latency": {
+            k: round(v, 3) for k, v in percentiles([r.elapsed for r in results]).items()},
+        "exporter_latency": {
+            k: round(v, 3) for k, v in percentiles([c["latency"] for c in calls]).items()},
+        "measurements_received": sum(c["measurements"] for c in calls if c["returncode"] == 0),
+    }
+    if args.work_dir is None:
+        shutil.rmtree(work_dir, ignore_errors = True)
+    return report
+
+
+def main(argv = None):
+    report = run(parse_args(argv))
+    print(json.dumps(report, indent = 2))
+
+
+if __name__ == "__main__":
+    main()